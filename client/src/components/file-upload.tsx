@@ -8,6 +8,20 @@ import { toast } from 'sonner';
 import { Button } from './ui/button';
 import { Input } from './ui/input';
 
+// The report is generated in the background, poll the job until it is finished
+async function waitForJob(jobId: string) {
+  while (true) {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    const response = await fetch(`http://localhost:8000/jobs/${jobId}`);
+    const job = await response.json();
+    if (!response.ok) throw new Error(job.error ?? 'Report generation failed');
+    if (job.status === 'done') return job;
+    if (job.status === 'failed') {
+      throw new Error(job.error ?? 'Report generation failed');
+    }
+  }
+}
+
 export default function FileUpload() {
   const [isDragging, setIsDragging] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
@@ -75,6 +89,11 @@ export default function FileUpload() {
       if (!reponse.ok) {
         throw new Error('An error occurred while uploading the file');
       }
+      const { job_id } = await reponse.json();
+      if (!job_id) {
+        throw new Error('An error occurred while uploading the file');
+      }
+      await waitForJob(job_id);
     } catch (error) {
       toast.error('An error occurred while uploading the file');
       setIsUploading(false);
@@ -1,7 +1,11 @@
+import ScatterPlot from '@/components/scatter-plot';
 import { cn } from '@/lib/utils';
+import { useChatStore } from '@/stores/chat.store';
 import { faSpinner, faUser, faWandMagicSparkles } from '@fortawesome/free-solid-svg-icons';
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome';
 
+const PLOT_PLACEHOLDER = /<div data-plot="([0-9a-f]+)"><\/div>/;
+
 type MessageProps = {
   author: 'system' | 'user';
   message: string;
@@ -25,7 +29,16 @@ export default function Message({ author, message, side = 'left', isStreaming, i
     </div>
   );
 
-  const content = <div dangerouslySetInnerHTML={{ __html: message }} className=''></div>;
+  const plots = useChatStore((state) => state.plots);
+
+  // Plot placeholders (<div data-plot="id"></div>) are replaced with plots rendered from the received data
+  const content = message.split(PLOT_PLACEHOLDER).map((part, index) =>
+    index % 2 == 1 ? (
+      plots[part] && <ScatterPlot key={index} plot={plots[part]} />
+    ) : (
+      <div key={index} dangerouslySetInnerHTML={{ __html: part }} className=''></div>
+    )
+  );
 
   return (
     <div className={cn('flex w-full items-start gap-4', side == 'left' ? 'justify-start' : 'justify-end')}>
@@ -0,0 +1,75 @@
+import { PlotData } from '@/stores/chat.store';
+
+const WIDTH = 480;
+const HEIGHT = 320;
+const PADDING = { top: 12, right: 12, bottom: 40, left: 56 };
+const TICKS = 5;
+
+type ScatterPlotProps = {
+  plot: PlotData;
+};
+export default function ScatterPlot({ plot }: ScatterPlotProps) {
+  const { x_axis, y_axis } = plot;
+  const innerWidth = WIDTH - PADDING.left - PADDING.right;
+  const innerHeight = HEIGHT - PADDING.top - PADDING.bottom;
+
+  // Avoid a division by zero for constant columns
+  const xRange = x_axis.max - x_axis.min || 1;
+  const yRange = y_axis.max - y_axis.min || 1;
+  const scaleX = (value: number) => PADDING.left + ((value - x_axis.min) / xRange) * innerWidth;
+  const scaleY = (value: number) => PADDING.top + innerHeight - ((value - y_axis.min) / yRange) * innerHeight;
+
+  const ticks = (min: number, range: number) =>
+    Array.from({ length: TICKS }, (_, index) => min + (range * index) / (TICKS - 1));
+
+  return (
+    <figure className='w-full'>
+      <svg viewBox={`0 0 ${WIDTH} ${HEIGHT}`} className='w-full bg-white rounded-lg text-slate-700'>
+        {ticks(x_axis.min, xRange).map((tick, index) => (
+          <text key={`x${index}`} x={scaleX(tick)} y={HEIGHT - 24} fontSize={10} textAnchor='middle' fill='currentColor'>
+            {formatTick(tick)}
+          </text>
+        ))}
+        {ticks(y_axis.min, yRange).map((tick, index) => (
+          <text key={`y${index}`} x={PADDING.left - 6} y={scaleY(tick) + 3} fontSize={10} textAnchor='end' fill='currentColor'>
+            {formatTick(tick)}
+          </text>
+        ))}
+        <rect
+          x={PADDING.left}
+          y={PADDING.top}
+          width={innerWidth}
+          height={innerHeight}
+          fill='none'
+          stroke='currentColor'
+          strokeOpacity={0.3}
+        />
+        {plot.x.map((x, index) => (
+          <circle key={index} cx={scaleX(x)} cy={scaleY(plot.y[index])} r={2.5} fill={plot.color} fillOpacity={0.8} />
+        ))}
+        <text x={PADDING.left + innerWidth / 2} y={HEIGHT - 6} fontSize={12} textAnchor='middle' fill='currentColor'>
+          {x_axis.label}
+        </text>
+        <text
+          x={14}
+          y={PADDING.top + innerHeight / 2}
+          fontSize={12}
+          textAnchor='middle'
+          fill='currentColor'
+          transform={`rotate(-90 14 ${PADDING.top + innerHeight / 2})`}
+        >
+          {y_axis.label}
+        </text>
+      </svg>
+      {plot.x.length < plot.total && (
+        <figcaption className='text-xs text-slate-500 mt-1'>
+          Showing {plot.x.length} of {plot.total} points
+        </figcaption>
+      )}
+    </figure>
+  );
+}
+
+function formatTick(value: number) {
+  return Math.abs(value) >= 1000 || Math.abs(value) < 0.01 ? value.toPrecision(3) : value.toFixed(2);
+}
@@ -35,14 +35,19 @@ export function Component() {
     addEvent,
     streamingMessage,
     setStreamingMessage,
+    appendStreamingDelta,
     toolCall,
     setToolCall,
     quickActions,
     setQuickActions,
     quickActionsLoading,
     setQuickActionsLoading,
+    addPlot,
   } = useChatStore();
   const chat = useRef<HTMLDivElement>(null);
+  // The websocket handlers are created once, they read the current profile through the ref
+  const selectedProfileRef = useRef(selectedProfile);
+  selectedProfileRef.current = selectedProfile;
 
   const { chatId } = useLoaderData() as LoaderData;
 
@@ -69,24 +74,46 @@ export function Component() {
     ws.onopen = () => {
       console.log('Connected to localhost:8000');
 
-      ws.send(JSON.stringify({ type: 'initChat', chatId, user_profile: selectedProfile }));
+      initChat();
     };
 
+    const initChat = () =>
+      ws.send(
+        JSON.stringify({
+          type: 'initChat',
+          chatId,
+          user_profile: selectedProfileRef.current,
+          protocol: 'delta',
+          plotMode: 'data',
+        })
+      );
+
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
       if (Object.keys(data).includes('type')) {
         if (data.type === 'message') {
           setStreamingMessage(data.message, data.isFinished);
           chat.current?.scrollTo(0, chat.current.scrollHeight);
+        } else if (data.type === 'message_delta') {
+          appendStreamingDelta(data.delta, data.seq);
+          chat.current?.scrollTo(0, chat.current.scrollHeight);
         } else if (data.type == 'tool_call') {
           setToolCall(data.name);
           chat.current?.scrollTo(0, chat.current.scrollHeight);
+        } else if (data.type == 'plot_data') {
+          addPlot(data);
         } else if (data.type == 'quick_actions') {
           if (data.loading) {
             setQuickActionsLoading(true);
           } else {
             setQuickActions(data.actions);
           }
+        } else if (data.type == 'session_expired') {
+          // The server dropped the idle session, the chat starts over with the same report
+          setToolCall('');
+          setStreamingMessage('', false);
+          addEvent('Session expired, the chat was restarted');
+          initChat();
         } else if (data.type == 'user_profile_updated') {
           setSelectedProfile(data.user_profile);
           addEvent(`Profile changed to ${data.user_profile}`);
@@ -10,6 +10,23 @@ type Message = {
   content: string;
 };
 
+type PlotAxis = {
+  label: string;
+  min: number;
+  max: number;
+};
+
+export type PlotData = {
+  id: string;
+  kind: 'scatter';
+  x: number[];
+  y: number[];
+  total: number;
+  color: string;
+  x_axis: PlotAxis;
+  y_axis: PlotAxis;
+};
+
 type ChatEntry =
   | {
       type: 'message';
@@ -28,6 +45,10 @@ type ChatStore = {
   addMessage: (message: Message) => void;
   addEvent: (event: string) => void;
   setStreamingMessage: (message: string, isFinished: boolean) => void;
+  streamingSeq: number;
+  appendStreamingDelta: (delta: string, seq: number) => void;
+  plots: Record<string, PlotData>;
+  addPlot: (plot: PlotData) => void;
   quickActions: QuickAction[];
   quickActionsLoading: boolean;
   setQuickActions: (quickActions: QuickAction[]) => void;
@@ -44,7 +65,7 @@ export const useChatStore = create<ChatStore>()((set, get) => ({
   setStreamingMessage: (message: string, isFinished: boolean) => {
     set({ toolCall: '' });
     if (isFinished) {
-      set({ streamingMessage: '' });
+      set({ streamingMessage: '', streamingSeq: 0 });
       set({
         chatEntries: [...get().chatEntries, { type: 'message', message: { author: 'system', content: message } }],
       });
@@ -52,6 +73,15 @@ export const useChatStore = create<ChatStore>()((set, get) => ({
       set({ streamingMessage: message });
     }
   },
+  streamingSeq: 0,
+  appendStreamingDelta: (delta: string, seq: number) => {
+    // Out of order frames are skipped, the final frame always carries the full message
+    if (seq !== get().streamingSeq) return;
+    const streamingMessage = seq === 0 ? delta : get().streamingMessage + delta;
+    set({ toolCall: '', streamingSeq: seq + 1, streamingMessage });
+  },
+  plots: {},
+  addPlot: (plot: PlotData) => set({ plots: { ...get().plots, [plot.id]: plot } }),
   quickActions: [],
   setQuickActions: (quickActions: QuickAction[]) => set({ quickActions, quickActionsLoading: false }),
   quickActionsLoading: false,
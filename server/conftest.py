@@ -0,0 +1,2 @@
+# prompt_test.py is a manual script against the OpenAI API, not a pytest module
+collect_ignore = ["lib/prompt_test.py"]
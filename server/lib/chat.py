@@ -1,67 +1,127 @@
+import asyncio
 import base64
 import json
 import os
-import sqlite3
 import time
 from fastapi import WebSocket
 from openai import AsyncStream
-import matplotlib.pyplot as plt
-import matplotlib
-
-matplotlib.use("Agg")
-import uuid
 
+from lib.context_window import ContextWindow
+from lib.downsample import SCATTER_MAX_POINTS
+from lib.results_cache import get_results
+from lib.sessions import session_store
+from lib.message_stream import MessageSender
+from lib.plot_store import plot_store
+from lib.plotting import scatter_plot_data, scatter_plot_png
 from lib.prompt import AnswerStyle, Format, Model, Persona, PromptGenerator
 
-chats = {}
+quick_action_tasks = {}
+
+# Upper bound of points sent to the client per plot in the "data" plot mode
+PLOT_DATA_MAX_POINTS = int(os.environ.get("PLOT_DATA_MAX_POINTS", "2000"))
 
+# The description is part of the completion cache key, answers of both plot modes are cached apart
+SCATTER_PLOT_DESCRIPTIONS = {
+    "image": "Create a scatter plot of the dataset. Returns an string with the HTML img tag wrapped in an a tag.",
+    "data": "Create a scatter plot of the dataset. Returns a placeholder HTML tag for the plot, which has to be included in the answer as is.",
+}
 
-def get_bynd_color(index):
-    colors = ["#5B7F9E", "#A5C2E8", "#EBDC03", "#F69B00", "#AAC001"]
-    return colors[index % len(colors)]
+# Quick actions start from the partial answer once it has this many characters
+QUICK_ACTIONS_SPECULATIVE_LENGTH = 600
 
 
 def get_dataset_columns(chatId):
-    db = sqlite3.connect("db.sqlite3")
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM reports WHERE id = ?", (int(chatId),))
+    columns = get_results(int(chatId)).columns.keys()
+    print(columns)
 
-    row = cursor.fetchone()
+    return columns
 
-    results = json.loads(row[3])
 
-    columns = results["data"].keys()
-    print(columns)
+def render_scatter_plot(chatId, x_column, y_column, color="#6da7cd", dpi=600):
+    # Returns the file name of the plot in the plot store, the same arguments always give the same file
+    recipe = {
+        "kind": "scatter",
+        "chatId": int(chatId),
+        "x_column": x_column,
+        "y_column": y_column,
+        "color": color,
+        "dpi": dpi,
+    }
+    key = plot_store.key(
+        report=int(chatId),
+        x=x_column,
+        y=y_column,
+        style={"kind": "scatter", "color": color, "max_points": SCATTER_MAX_POINTS},
+        dpi=dpi,
+    )
 
-    return columns
+    def render():
+        results = get_results(int(chatId))
+        return scatter_plot_png(
+            results.columns[x_column], results.columns[y_column], x_column, y_column, color, dpi=dpi
+        )
+
+    return plot_store.get_or_render(key, render, recipe)
+
+
+def render_plot_recipe(recipe: dict) -> str:
+    if recipe.get("kind") != "scatter":
+        raise ValueError(f"Unknown plot kind {recipe.get('kind')}")
+    return render_scatter_plot(
+        recipe["chatId"], recipe["x_column"], recipe["y_column"], recipe["color"], recipe["dpi"]
+    )
 
 
 def scatter_plot_bytes(chatId, x_column, y_column, color="#6da7cd"):
+    image_name = render_scatter_plot(chatId, x_column, y_column, color)
+
+    # Served by /plots, which renders the plot again if it was evicted from the store in the meantime
+    return f"""<a href="http://localhost:8000/plots/{image_name}" target="_blank"><img src="http://localhost:8000/plots/{image_name}" width="100%" /></a>"""
 
-    db = sqlite3.connect("db.sqlite3")
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM reports WHERE id = ?", (int(chatId),))
 
-    row = cursor.fetchone()
+def scatter_plot_id(chatId, x_column, y_column, color="#6da7cd"):
+    return plot_store.key(
+        report=int(chatId), x=x_column, y=y_column, style={"kind": "scatter", "color": color}
+    )[:16]
 
-    results = json.loads(row[3])
 
-    image_id = uuid.uuid4().hex
+def numeric_plot_columns(chatId, x_column, y_column):
+    # Text columns can only be drawn by matplotlib
+    results = get_results(int(chatId))
+    x = results.columns[x_column]
+    y = results.columns[y_column]
 
-    x = results["data"][x_column]
-    y = results["data"][y_column]
+    if x.dtype.kind not in "biuf" or y.dtype.kind not in "biuf":
+        return None
+    return x, y
+
+
+def scatter_plot_payload(chatId, x_column, y_column, color="#6da7cd"):
+    columns = numeric_plot_columns(chatId, x_column, y_column)
+    if columns is None:
+        return None
+
+    return {
+        "id": scatter_plot_id(chatId, x_column, y_column, color),
+        **scatter_plot_data(*columns, x_column, y_column, color, PLOT_DATA_MAX_POINTS),
+    }
 
-    plt.clf()
-    plt.scatter(x, y, color=color)
-    plt.xlabel(x_column)
-    plt.ylabel(y_column)
 
-    plt.savefig(f"./static/{image_id}.png", dpi=600)
+async def send_plot_data(socket: WebSocket, chatId, args: dict):
+    try:
+        payload = await asyncio.to_thread(
+            scatter_plot_payload, chatId, args["x_column"], args["y_column"]
+        )
+    except (KeyError, TypeError, ValueError) as error:
+        # The tool call itself reports the error back to the model
+        print(f"Could not prepare plot data: {error}")
+        return
 
-    return f"""<a href="http://localhost:8000/static/{image_id}.png" target="_blank"><img src="http://localhost:8000/static/{image_id}.png" width="100%" /></a>"""
+    if payload is not None:
+        await socket.send_json({"type": "plot_data", **payload})
 
 
-def get_quick_actions(api_key: str, response_message: str):
+async def get_quick_actions(api_key: str, response_message: str):
 
     response = PromptGenerator(
         f"""
@@ -82,43 +142,90 @@ def get_quick_actions(api_key: str, response_message: str):
         response_structure={"actions": [{"label": "", "prompt": ""}]},
         format=Format.JSON,
         plain=True,
-    ).run(api_key=api_key)
+    ).arun(api_key=api_key)
 
     response_string = ""
-    for chunk in response:
+    async for chunk in response:
         if chunk["type"] == "ai_response" and chunk["content"] != None:
             response_string += chunk["content"]
 
     return json.loads(response_string)["actions"]
 
 
+async def send_quick_actions(api_key: str, socket: WebSocket, response_message: str):
+    # Runs as a background task, every failure ends in a final frame so the client stops loading
+    try:
+        actions = await get_quick_actions(api_key, response_message)
+    except Exception as error:
+        print(f"Could not generate quick actions: {error!r}")
+        actions = []
+
+    try:
+        await socket.send_json({"type": "quick_actions", "actions": actions})
+    except Exception as error:
+        print(f"Could not send quick actions: {error!r}")
+
+
+async def start_quick_actions(
+    api_key: str, socket: WebSocket, session_id: str, response_message: str
+):
+    await socket.send_json(
+        {
+            "type": "quick_actions",
+            "loading": True,
+        }
+    )
+    quick_action_tasks[session_id] = asyncio.create_task(
+        send_quick_actions(api_key, socket, response_message)
+    )
+
+
+def cancel_quick_actions(session_id: str):
+    task = quick_action_tasks.pop(session_id, None)
+    if task and not task.done():
+        task.cancel()
+
+
 async def handleMessage(
-    api_key: str, socket: WebSocket, message: str, user_profile: str
+    api_key: str,
+    socket: WebSocket,
+    session_id: str,
+    message: str,
+    user_profile: str,
 ):
 
-    if not socket.client or not socket.client.host:
-        raise ValueError("Invalid socket client or host")
+    session = await session_store.aget(session_id)
+    if session is None:
+        await send_session_expired(socket)
+        return
 
-    if socket.client.host not in chats:
-        raise ValueError("Chat not initialized")
+    chatId = session["chatId"]
+    messages = session["messages"]
+    persona = get_persona(user_profile)
 
-    chatId = chats[socket.client.host]["chatId"]
-    messages = chats[socket.client.host]["messages"]
-    persona = Persona.NON_TECHNICAL
+    # The profile can change with every message, the pinned instructions only when it does
+    pin_instructions(session, persona)
+
+    # Quick actions of the previous answer are outdated as soon as a new message arrives
+    cancel_quick_actions(session_id)
 
     # Function Wrapper
     def get_column_headers():
         return list(get_dataset_columns(chatId))
 
+    # In the "data" plot mode the points are sent to the client, the model only gets a placeholder tag
+    plot_mode = session.get("plot_mode", "image")
+    if plot_mode not in SCATTER_PLOT_DESCRIPTIONS:
+        plot_mode = "image"
+
     def create_scatter_plot(x_column, y_column):
+        if plot_mode == "data" and numeric_plot_columns(chatId, x_column, y_column):
+            return f"""<div data-plot="{scatter_plot_id(chatId, x_column, y_column)}"></div>"""
+
         return scatter_plot_bytes(chatId, x_column, y_column)
 
-    if user_profile == "technical":
-        persona = Persona.TECHNICAL
-    elif user_profile == "business":
-        persona = Persona.BUSINESS
-    elif user_profile == "expert":
-        persona = Persona.EXPERT
+    # The instructions and the metrics and context of the report stay pinned
+    context_window = ContextWindow(Model.GPT_4_TURBO.value, pinned=2)
 
     response = PromptGenerator(
         prompt=message,
@@ -140,7 +247,7 @@ async def handleMessage(
                 "type": "function",
                 "function": {
                     "name": "create_scatter_plot",
-                    "description": "Create a scatter plot of the dataset. Returns an string with the HTML img tag wrapped in an a tag.",
+                    "description": SCATTER_PLOT_DESCRIPTIONS[plot_mode],
                     "parameters": {
                         "type": "object",
                         "properties": {
@@ -162,26 +269,32 @@ async def handleMessage(
             "get_column_headers": get_column_headers,
             "create_scatter_plot": create_scatter_plot,
         },
-    ).run(api_key)
-
-    response_message = None
-    for chunk in response:  # type: ignore
+        context_window=context_window,
+        pinned_instructions=True,
+        # Tool results (plot ids and links) depend on the report, not only on the conversation
+        cache_scope=f"report:{chatId}",
+    ).arun(api_key)
+
+    sender = MessageSender(socket, session["protocol"])
+    quick_actions_started = False
+    async for chunk in response:
         if chunk["type"] == "ai_response":
             if chunk["content"] == None:
-                break
+                continue
             else:
-                if not response_message:
-                    response_message = chunk["content"]
-                else:
-                    response_message += chunk["content"]
-                await socket.send_json(
-                    {
-                        "type": "message",
-                        "message": response_message,
-                        "isFinished": False,
-                    }
-                )
+                await sender.push(chunk["content"])
+
+                # Generate quick actions alongside the rest of the answer
+                if (
+                    not quick_actions_started
+                    and sender.length >= QUICK_ACTIONS_SPECULATIVE_LENGTH
+                ):
+                    quick_actions_started = True
+                    await start_quick_actions(
+                        api_key, socket, session_id, sender.message  # type: ignore
+                    )
         elif chunk["type"] == "tool_call":
+            await sender.flush()
             await socket.send_json(
                 {
                     "type": "tool_call",
@@ -189,64 +302,122 @@ async def handleMessage(
                     "args": json.dumps(chunk["args"]),
                 }
             )
+            # Sent from the tool call so replayed answers from the completion cache get their plot data too
+            if plot_mode == "data" and chunk["name"] == "create_scatter_plot":
+                await send_plot_data(socket, chatId, chunk["args"])
+        elif chunk["type"] == "tool_result":
+            await socket.send_json(
+                {
+                    "type": "tool_result",
+                    "name": chunk["name"],
+                    "ok": chunk["ok"],
+                }
+            )
 
-    await socket.send_json(
-        {"type": "message", "message": response_message, "isFinished": True}
-    )
+    await sender.finish()
+    response_message = sender.message
 
-    if response_message:
-        await socket.send_json(
-            {
-                "type": "quick_actions",
-                "loading": True,
-            }
-        )
-        await socket.send_json(
-            {
-                "type": "quick_actions",
-                "actions": get_quick_actions(api_key, response_message),
-            }
+    if context_window.stats:
+        print(f"Context window: {context_window.stats}")
+        await socket.send_json({"type": "context_stats", **context_window.stats})
+
+    if response_message and not quick_actions_started:
+        await start_quick_actions(
+            api_key, socket, session_id, response_message
         )
 
-    messages.append({"role": "user", "content": message})
-    messages.append({"role": "system", "content": response_message})
-    chats[socket.client.host]["messages"] = messages
+    # The question itself is already part of the history, only the answer is missing
+    messages.append({"role": "assistant", "content": response_message})
+    session["messages"] = messages
+    await session_store.aset(session_id, session)
 
 
-async def update_user_profile(socket: WebSocket, user_profile: str):
-    if not socket.client or not socket.client.host:
-        raise ValueError("Invalid socket client or host")
+def get_persona(user_profile: str) -> Persona:
+    if user_profile == "technical":
+        return Persona.TECHNICAL
+    elif user_profile == "business":
+        return Persona.BUSINESS
+    elif user_profile == "expert":
+        return Persona.EXPERT
+    return Persona.NON_TECHNICAL
 
-    current_chat = chats[socket.client.host]
 
-    await init_chat(socket, current_chat["chatId"], user_profile)
+def chat_instructions(persona: Persona) -> str:
+    generator = PromptGenerator(
+        "",
+        persona=persona,
+        format=Format.HTML,
+        model=Model.GPT_4_TURBO,
+        answerStyle=AnswerStyle.EXPLANATION,
+    )
+    print(f"Chat instructions ({persona.value}): {generator.instructions_tokens()} tokens")
+
+    return generator.instructions()
+
+
+def pin_instructions(session: dict, persona: Persona):
+    # Persona and format instructions live in one system message at the start of the history
+    if session.get("persona") == persona.value:
+        return
+
+    messages = session["messages"]
+    instructions = {"role": "system", "content": chat_instructions(persona)}
+    if messages and messages[0]["role"] == "system":
+        messages[0] = instructions
+    else:
+        messages.insert(0, instructions)
+    session["persona"] = persona.value
+
+
+async def send_session_expired(socket: WebSocket):
+    # Sessions are evicted when idle or when the store is full, the client starts a new chat with initChat
+    await socket.send_json({"type": "session_expired"})
+
+
+async def update_user_profile(socket: WebSocket, session_id: str, user_profile: str):
+    current_chat = await session_store.aget(session_id)
+    if current_chat is None:
+        await send_session_expired(socket)
+        return
+
+    await init_chat(
+        socket,
+        session_id,
+        current_chat["chatId"],
+        user_profile,
+        current_chat["protocol"],
+        current_chat.get("plot_mode", "image"),
+    )
 
     await socket.send_json(
         {"type": "user_profile_updated", "user_profile": user_profile}
     )
 
 
-async def init_chat(socket: WebSocket, chatId: str, user_profile: str):
-    db = sqlite3.connect("db.sqlite3")
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM reports WHERE id = ?", (int(chatId),))
-
-    row = cursor.fetchone()
-
-    results = json.loads(row[3])
+async def init_chat(
+    socket: WebSocket,
+    session_id: str,
+    chatId: str,
+    user_profile: str,
+    protocol: str = "full",
+    plot_mode: str = "image",
+):
+    results = get_results(int(chatId))
 
     initial_prompt = f"""
         The following results are information regarding the results of an linear regression model.
         
-        results: {json.dumps(results['metrics'])}
-        context of the results: {results['context']}
+        results: {json.dumps(results.metrics)}
+        context of the results: {results.context}
     """
 
-    if not socket.client or not socket.client.host:
-        raise ValueError("Invalid socket client or host")
-
-    chats[socket.client.host] = {
+    session = {
         "chatId": chatId,
         "messages": [{"role": "user", "content": initial_prompt}],
         "user_profile": user_profile,
+        "protocol": protocol,
+        "plot_mode": plot_mode,
     }
+    pin_instructions(session, get_persona(user_profile))
+
+    await session_store.aset(session_id, session)
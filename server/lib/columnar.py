@@ -0,0 +1,93 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+
+from lib.file_store import atomic_write
+
+COLUMN_STORE_PATH = os.environ.get("COLUMN_STORE_PATH", "columns")
+
+
+def to_column(values: list) -> np.ndarray:
+    column = np.asarray(values)
+
+    # Mixed or missing values, prefer floats (None becomes NaN) and fall back to strings
+    if column.dtype == object:
+        try:
+            column = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            column = np.asarray(["" if value is None else str(value) for value in values])
+
+    return column
+
+
+def to_index(keys: list) -> np.ndarray:
+    try:
+        return np.asarray([int(key) for key in keys], dtype=np.int64)
+    except (TypeError, ValueError):
+        return np.asarray([str(key) for key in keys])
+
+
+def normalize_data(data: dict) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    # Converts {column: {index: value}} (or {column: [values]}) into typed columns and one shared index
+    index = None
+    columns = {}
+
+    for name, values in data.items():
+        if isinstance(values, dict):
+            keys = list(values.keys())
+            values = list(values.values())
+        else:
+            keys = list(range(len(values)))
+
+        if index is None:
+            index = keys
+        elif keys != index:
+            raise ValueError(f"Column {name} does not share the index of the other columns")
+
+        columns[name] = to_column(values)
+
+    return to_index(index or []), columns
+
+
+class ColumnStore:
+    # Content addressed .npy files, identical columns are stored once and can be memory-mapped
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _file(self, digest: str) -> str:
+        return os.path.join(self.path, digest[:2], f"{digest}.npy")
+
+    def put(self, column: np.ndarray) -> str:
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(column), allow_pickle=False)
+        data = buffer.getvalue()
+
+        digest = hashlib.sha256(data).hexdigest()
+        file = self._file(digest)
+
+        if not os.path.exists(file):
+            atomic_write(file, data)
+
+        return digest
+
+    def get(self, digest: str, mmap: bool = True) -> np.ndarray:
+        return np.load(self._file(digest), mmap_mode="r" if mmap else None, allow_pickle=False)
+
+
+column_store = ColumnStore(COLUMN_STORE_PATH)
+
+
+def store_columns(index: np.ndarray, columns: dict[str, np.ndarray]) -> tuple[str, dict[str, str]]:
+    return column_store.put(index), {
+        name: column_store.put(column) for name, column in columns.items()
+    }
+
+
+def load_columns(
+    index_digest: str, column_digests: list[tuple[str, str]]
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    return column_store.get(index_digest), {
+        name: column_store.get(digest) for name, digest in column_digests
+    }
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from lib.llm_cache import normalize_content
+
+COMPLETION_CACHE_SIZE = int(os.environ.get("COMPLETION_CACHE_SIZE", "128"))
+
+
+class CachedCompletion:
+    def __init__(self, chunks: list, messages: list) -> None:
+        # chunks are replayed to the consumer, messages are appended to the history (tool calls and results)
+        self.chunks = chunks
+        self.messages = messages
+
+
+def compact_chunks(chunks: list) -> list:
+    # Consecutive text chunks are merged, the replay still streams text, tool calls and the closing chunk in order
+    compacted = []
+    for chunk in chunks:
+        if (
+            chunk["type"] == "ai_response"
+            and chunk["content"] is not None
+            and compacted
+            and compacted[-1]["type"] == "ai_response"
+            and compacted[-1]["content"] is not None
+        ):
+            compacted[-1] = {
+                "type": "ai_response",
+                "content": compacted[-1]["content"] + chunk["content"],
+            }
+        else:
+            compacted.append(chunk)
+    return compacted
+
+
+def completion_key(model: str, options: dict, tools: list, messages: list) -> str:
+    normalized = {
+        "model": model,
+        "options": options,
+        "tools": tools,
+        "messages": [
+            {**message, "content": normalize_content(message.get("content"))}
+            for message in messages
+        ],
+    }
+    return hashlib.sha256(
+        json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.entries: OrderedDict[str, CachedCompletion] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> CachedCompletion | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CachedCompletion):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+completion_cache = CompletionCache(COMPLETION_CACHE_SIZE)
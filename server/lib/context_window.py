@@ -0,0 +1,143 @@
+import json
+import os
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Prompt token budget per model, well below the model limits to keep long sessions cheap and fast
+CONTEXT_BUDGETS = {
+    "gpt-3.5": 3000,
+    "gpt-3.5-turbo": 12000,
+    "gpt-4": 6000,
+    "gpt-4-turbo": int(os.environ.get("CONTEXT_BUDGET_GPT_4_TURBO", "24000")),
+}
+DEFAULT_BUDGET = 6000
+
+# Rough cost of an image part in a message (high detail 512px tile)
+IMAGE_TOKENS = 765
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PREFIX = "Summary of earlier conversation turns that are no longer included:"
+SUMMARY_MAX_LINES = 20
+
+_encodings = {}
+
+
+def _encoding(model: str):
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)  # type: ignore
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")  # type: ignore
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str) -> int:
+    if not text:
+        return 0
+    if tiktoken is None:
+        # Without tiktoken, about four characters per token for English text
+        return len(text) // 4 + 1
+    return len(_encoding(model).encode(text))
+
+
+def message_text(message: dict) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return " ".join(part["text"] for part in content if part.get("type") == "text")
+    return content or ""
+
+
+def message_tokens(message: dict, model: str) -> int:
+    tokens = MESSAGE_OVERHEAD + count_tokens(message_text(message), model)
+
+    content = message.get("content")
+    if isinstance(content, list):
+        tokens += IMAGE_TOKENS * sum(1 for part in content if part.get("type") == "image_url")
+
+    for tool_call in message.get("tool_calls") or []:
+        tokens += count_tokens(json.dumps(tool_call["function"]), model)
+
+    return tokens
+
+
+def _is_summary(message: dict) -> bool:
+    return message.get("role") == "system" and message_text(message).startswith(SUMMARY_PREFIX)
+
+
+class ContextWindow:
+    # Keeps the pinned preamble and the newest turns within the budget, older turns are reduced to a short summary
+    def __init__(self, model: str, budget: int | None = None, pinned: int = 1) -> None:
+        self.model = model
+        self.budget = budget or CONTEXT_BUDGETS.get(model, DEFAULT_BUDGET)
+        self.pinned = pinned
+        self.stats = {}
+
+    def _split_turns(self, messages: list) -> list[list]:
+        turns = []
+        for message in messages:
+            if message.get("role") == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def _summary(self, summary: dict | None, dropped: list[list]) -> dict:
+        lines = message_text(summary).splitlines()[1:] if summary else []
+        for turn in dropped:
+            question = " ".join(message_text(turn[0]).split())
+            if question:
+                lines.append(f"- {question[:100]}")
+
+        return {
+            "role": "system",
+            "content": "\n".join([SUMMARY_PREFIX] + lines[-SUMMARY_MAX_LINES:]),
+        }
+
+    def fit(self, messages: list) -> list:
+        pinned = messages[: self.pinned]
+        rest = messages[self.pinned :]
+
+        summary = None
+        if rest and _is_summary(rest[0]):
+            summary = rest[0]
+            rest = rest[1:]
+
+        turns = self._split_turns(rest)
+        turn_tokens = [sum(message_tokens(message, self.model) for message in turn) for turn in turns]
+
+        fixed_tokens = sum(message_tokens(message, self.model) for message in pinned)
+
+        def summary_tokens(message: dict | None) -> int:
+            return message_tokens(message, self.model) if message else 0
+
+        # The newest turn is always kept, it contains the current question. The summary of the
+        # dropped turns grows with every drop, so its projected size is part of the check.
+        dropped = []
+        new_summary = summary
+        while (
+            len(turns) > 1
+            and fixed_tokens + summary_tokens(new_summary) + sum(turn_tokens) > self.budget
+        ):
+            dropped.append(turns.pop(0))
+            turn_tokens.pop(0)
+            new_summary = self._summary(summary, dropped)
+
+        # With only the newest turn left the summary itself may not fit, its oldest lines go first
+        while new_summary and fixed_tokens + summary_tokens(new_summary) + sum(turn_tokens) > self.budget:
+            lines = message_text(new_summary).splitlines()[2:]
+            new_summary = (
+                {"role": "system", "content": "\n".join([SUMMARY_PREFIX] + lines)} if lines else None
+            )
+
+        summary = new_summary
+
+        self.stats = {
+            "prompt_tokens": fixed_tokens + summary_tokens(summary) + sum(turn_tokens),
+            "budget": self.budget,
+            "dropped_turns": len(dropped),
+            "messages": len(pinned) + (1 if summary else 0) + sum(len(turn) for turn in turns),
+        }
+
+        return pinned + ([summary] if summary else []) + [message for turn in turns for message in turn]
@@ -0,0 +1,39 @@
+from lib.context_window import ContextWindow, message_tokens
+
+
+def conversation(turns: int) -> list:
+    messages = [{"role": "system", "content": "Instructions"}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Question number {turn} about the sales data?"})
+        messages.append({"role": "assistant", "content": f"Answer number {turn}."})
+    return messages
+
+
+def test_fit_keeps_the_summary_within_the_budget():
+    window = ContextWindow("gpt-4-turbo", budget=300, pinned=1)
+
+    fitted = window.fit(conversation(30))
+
+    assert window.stats["prompt_tokens"] <= 300
+    assert sum(message_tokens(message, "gpt-4-turbo") for message in fitted) <= 300
+    assert fitted[0]["content"] == "Instructions"
+    assert fitted[-1]["content"] == "Answer number 29."
+
+
+def test_fit_keeps_fitting_when_called_again():
+    window = ContextWindow("gpt-4-turbo", budget=300, pinned=1)
+    messages = window.fit(conversation(30))
+
+    for turn in range(30, 40):
+        messages.append({"role": "user", "content": f"Question number {turn} about the sales data?"})
+        messages = window.fit(messages)
+
+        assert window.stats["prompt_tokens"] <= 300
+
+
+def test_fit_does_not_change_short_conversations():
+    window = ContextWindow("gpt-4-turbo", budget=3000, pinned=1)
+    messages = conversation(3)
+
+    assert window.fit(messages) == messages
+    assert window.stats["dropped_turns"] == 0
@@ -0,0 +1,201 @@
+import base64
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "db.sqlite3")
+POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", "8"))
+POOL_TIMEOUT = 30
+
+# Statements are kept as constants, so sqlite3's per-connection statement cache reuses the prepared statements
+SELECT_REPORTS = "SELECT id, label, created_at FROM reports ORDER BY created_at, id"
+SELECT_REPORTS_PAGE = "SELECT id, label, created_at FROM reports ORDER BY created_at, id LIMIT ?"
+SELECT_REPORTS_PAGE_AFTER = "SELECT id, label, created_at FROM reports WHERE (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?"
+SELECT_REPORT_PDF_BY_LABEL = "SELECT reports.label, report_pdfs.pdf_file FROM reports JOIN report_pdfs ON report_pdfs.report_id = reports.id WHERE reports.label = ?"
+SELECT_REPORT_RESULTS = "SELECT results_json FROM report_results WHERE report_id = ?"
+SELECT_REPORT_INDEX = "SELECT index_digest FROM report_results WHERE report_id = ?"
+SELECT_REPORT_COLUMNS = "SELECT name, digest FROM report_columns WHERE report_id = ? ORDER BY position"
+INSERT_REPORT = "INSERT INTO reports (label, created_at) VALUES (?, ?)"
+INSERT_REPORT_PDF = "INSERT INTO report_pdfs (report_id, pdf_file) VALUES (?, ?)"
+INSERT_REPORT_RESULTS = "INSERT INTO report_results (report_id, results_json, index_digest) VALUES (?, ?, ?)"
+INSERT_REPORT_COLUMN = "INSERT INTO report_columns (report_id, position, name, digest) VALUES (?, ?, ?, ?)"
+
+class ConnectionPool:
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = size
+
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(
+            self.path,
+            timeout=POOL_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=128,
+        )
+        # WAL lets readers continue while an upload is writing
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA foreign_keys=ON")
+        return db
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            can_create = self.created < self.size
+            if can_create:
+                self.created += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+
+        try:
+            return self.idle.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError("No database connection available")
+
+    def release(self, db: sqlite3.Connection):
+        self.idle.put_nowait(db)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        db = self.acquire()
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            self.release(db)
+
+    def close(self):
+        while True:
+            try:
+                db = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            db.close()
+            with self.lock:
+                self.created -= 1
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def open_database(path: str = DATABASE_PATH, size: int = POOL_SIZE) -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(path, size)
+        return _pool
+
+
+def close_database():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    pool = _pool if _pool is not None else open_database()
+    with pool.connection() as db:
+        yield db
+
+
+def list_reports() -> list:
+    with connection() as db:
+        return db.execute(SELECT_REPORTS).fetchall()
+
+
+def encode_cursor(row: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row[2], row[0]]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        created_at, report_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+    return str(created_at), int(report_id)
+
+
+def list_reports_page(limit: int, cursor: str | None = None) -> tuple[list, str | None]:
+    # Keyset pagination on (created_at, id), one extra row tells if there is a next page
+    with connection() as db:
+        if cursor is None:
+            rows = db.execute(SELECT_REPORTS_PAGE, (limit + 1,)).fetchall()
+        else:
+            created_at, report_id = decode_cursor(cursor)
+            rows = db.execute(
+                SELECT_REPORTS_PAGE_AFTER, (created_at, report_id, limit + 1)
+            ).fetchall()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+
+    return rows, None
+
+
+def get_report_pdf_by_label(label: str) -> tuple | None:
+    with connection() as db:
+        return db.execute(SELECT_REPORT_PDF_BY_LABEL, (label,)).fetchone()
+
+
+def get_report_results(report_id: int) -> str | None:
+    with connection() as db:
+        row = db.execute(SELECT_REPORT_RESULTS, (report_id,)).fetchone()
+
+    return row[0] if row else None
+
+
+def get_report_columns(report_id: int) -> tuple[str | None, list]:
+    with connection() as db:
+        row = db.execute(SELECT_REPORT_INDEX, (report_id,)).fetchone()
+        columns = db.execute(SELECT_REPORT_COLUMNS, (report_id,)).fetchall()
+
+    return (row[0] if row else None), columns
+
+
+def insert_report(
+    label: str,
+    pdf: bytes,
+    results_json: str,
+    created_at: str,
+    index_digest: str | None = None,
+    column_digests: dict[str, str] = {},
+) -> int:
+    with connection() as db:
+        report_id = db.execute(INSERT_REPORT, (label, created_at)).lastrowid
+        db.execute(INSERT_REPORT_PDF, (report_id, pdf))
+        db.execute(INSERT_REPORT_RESULTS, (report_id, results_json, index_digest))
+        db.executemany(
+            INSERT_REPORT_COLUMN,
+            [
+                (report_id, position, name, digest)
+                for position, (name, digest) in enumerate(column_digests.items())
+            ],
+        )
+        return report_id  # type: ignore
@@ -1,21 +1,134 @@
-from sqlite3 import Connection
+import json
 import sqlite3
 
+from lib.columnar import normalize_data, store_columns
+from lib.database import connection
 
-def seed():
-    db = sqlite3.connect("db.sqlite3")
 
-    cursor = db.cursor()
-    cursor.execute(
+def _split_report_payloads(db: sqlite3.Connection):
+    # Moves the pdf and results payloads out of the reports table, so listing reports only reads a narrow row
+    db.execute("ALTER TABLE reports RENAME TO reports_legacy")
+
+    db.execute(
         """
-            CREATE TABLE IF NOT EXISTS reports (
+            CREATE TABLE reports (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               label TEXT NOT NULL,
-              pdf_file BLOB NOT NULL,
-              results_json TEXT NOT NULL  
+              created_at TEXT NOT NULL
+            )
+        """
+    )
+    db.execute(
+        """
+            CREATE TABLE report_pdfs (
+              report_id INTEGER PRIMARY KEY REFERENCES reports(id) ON DELETE CASCADE,
+              pdf_file BLOB NOT NULL
+            )
+        """
+    )
+    db.execute(
+        """
+            CREATE TABLE report_results (
+              report_id INTEGER PRIMARY KEY REFERENCES reports(id) ON DELETE CASCADE,
+              results_json TEXT NOT NULL
+            )
+        """
+    )
+    db.execute("CREATE INDEX idx_reports_label ON reports (label)")
+    db.execute("CREATE INDEX idx_reports_created_at ON reports (created_at, id)")
+
+    db.execute(
+        """
+            INSERT INTO reports (id, label, created_at)
+            SELECT id, label, COALESCE(created_at, '') FROM reports_legacy
+        """
+    )
+    db.execute(
+        "INSERT INTO report_pdfs (report_id, pdf_file) SELECT id, pdf_file FROM reports_legacy"
+    )
+    db.execute(
+        "INSERT INTO report_results (report_id, results_json) SELECT id, results_json FROM reports_legacy"
+    )
+
+    db.execute("DROP TABLE reports_legacy")
+
+
+def _columnar_report_data(db: sqlite3.Connection):
+    # Moves the data section of the results into content addressed column files, results_json keeps metrics and context
+    db.execute("ALTER TABLE report_results ADD COLUMN index_digest TEXT")
+    db.execute(
+        """
+            CREATE TABLE report_columns (
+              report_id INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
+              position INTEGER NOT NULL,
+              name TEXT NOT NULL,
+              digest TEXT NOT NULL,
+              PRIMARY KEY (report_id, position)
             )
         """
     )
 
-    db.commit()
-    cursor.close()
+    rows = db.execute("SELECT report_id, results_json FROM report_results").fetchall()
+    for report_id, results_json in rows:
+        results = json.loads(results_json)
+        if "data" not in results:
+            continue
+
+        index, columns = normalize_data(results.pop("data"))
+        index_digest, column_digests = store_columns(index, columns)
+
+        db.execute(
+            "UPDATE report_results SET results_json = ?, index_digest = ? WHERE report_id = ?",
+            (json.dumps(results), index_digest, report_id),
+        )
+        db.executemany(
+            "INSERT INTO report_columns (report_id, position, name, digest) VALUES (?, ?, ?, ?)",
+            [
+                (report_id, position, name, digest)
+                for position, (name, digest) in enumerate(column_digests.items())
+            ],
+        )
+
+
+def _chat_sessions(db: sqlite3.Connection):
+    db.execute(
+        """
+            CREATE TABLE chat_sessions (
+              id TEXT PRIMARY KEY,
+              data TEXT NOT NULL,
+              updated_at REAL NOT NULL
+            )
+        """
+    )
+    db.execute("CREATE INDEX idx_chat_sessions_updated_at ON chat_sessions (updated_at)")
+
+
+# Each migration runs once, the applied version is tracked in PRAGMA user_version
+MIGRATIONS = [
+    _split_report_payloads,
+    _columnar_report_data,
+    _chat_sessions,
+]
+
+
+def seed():
+    with connection() as db:
+        db.execute(
+            """
+                CREATE TABLE IF NOT EXISTS reports (
+                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  label TEXT NOT NULL,
+                  pdf_file BLOB NOT NULL,
+                  results_json TEXT NOT NULL,
+                  created_at TEXT
+                )
+            """
+        )
+
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+
+        for index, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            db.execute("BEGIN")
+            migration(db)
+            db.execute(f"PRAGMA user_version = {index}")
+            db.commit()
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+# Scatter plots keep at most this many points, above the hexbin threshold a density plot is drawn instead
+SCATTER_MAX_POINTS = int(os.environ.get("SCATTER_MAX_POINTS", "5000"))
+SCATTER_HEXBIN_THRESHOLD = int(os.environ.get("SCATTER_HEXBIN_THRESHOLD", "200000"))
+DOWNSAMPLE_GRID_SIZE = 64
+
+
+def is_numeric(values) -> bool:
+    return np.asarray(values).dtype.kind in "biuf"
+
+
+def _cell_quota(counts: np.ndarray, max_points: int) -> int:
+    # Largest per-cell cap q with sum(min(count, q)) <= max_points
+    low, high = 1, int(counts.max())
+    while low < high:
+        middle = (low + high + 1) // 2
+        if np.minimum(counts, middle).sum() <= max_points:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def stratified_sample(
+    x, y, max_points: int = SCATTER_MAX_POINTS, grid_size: int = DOWNSAMPLE_GRID_SIZE, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    # Caps the number of points per grid cell, sparse cells (outliers and the edges of the cloud) are kept completely
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x = x[finite]
+        y = y[finite]
+
+    if len(x) <= max_points:
+        return x, y
+
+    def cell_index(values: np.ndarray) -> np.ndarray:
+        low, high = values.min(), values.max()
+        if high == low:
+            return np.zeros(len(values), dtype=np.int64)
+        scaled = (values - low) / (high - low) * grid_size
+        return np.minimum(scaled.astype(np.int64), grid_size - 1)
+
+    # At least one point per occupied cell has to fit into max_points
+    grid_size = max(1, min(grid_size, int(np.sqrt(max_points))))
+    cells = cell_index(x) * grid_size + cell_index(y)
+
+    # Random order inside each cell so the kept points are not biased towards the start of the file
+    shuffled = np.random.default_rng(seed).permutation(len(x))
+    order = shuffled[np.argsort(cells[shuffled], kind="stable")]
+    sorted_cells = cells[order]
+
+    starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+
+    keep = np.sort(order[rank < _cell_quota(counts, max_points)])
+    return x[keep], y[keep]
+
+
+def scatter_points(x, y, max_points: int = SCATTER_MAX_POINTS):
+    # Text columns are plotted as categories and are passed through unchanged
+    if not (is_numeric(x) and is_numeric(y)):
+        return np.asarray(x), np.asarray(y)
+    return stratified_sample(x, y, max_points)
+
+
+def use_hexbin(x, y, threshold: int = SCATTER_HEXBIN_THRESHOLD) -> bool:
+    return len(x) > threshold and is_numeric(x) and is_numeric(y)
@@ -0,0 +1,60 @@
+import os
+import threading
+
+# Helpers for the on-disk caches, files are replaced atomically and their mtime is the last access
+
+
+def atomic_write(file: str, data: bytes | str):
+    # Readers (and other processes) never see a partially written file
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    tmp_file = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_file, file)
+
+
+def touch(file: str) -> bool:
+    try:
+        os.utime(file)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def evict_least_recently_used(
+    path: str,
+    suffix: str,
+    max_entries: int | None = None,
+    max_bytes: int | None = None,
+    keep: str | None = None,
+):
+    # Removes the files (with the given suffix) accessed longest ago until both limits hold
+    entries = []
+    total = 0
+    for name in os.listdir(path):
+        if not name.endswith(suffix):
+            continue
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+        total += stat.st_size
+
+    count = len(entries)
+    entries.sort()
+    for _, size, name in entries:
+        if (max_entries is None or count <= max_entries) and (max_bytes is None or total <= max_bytes):
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+        count -= 1
+        total -= size
@@ -0,0 +1,276 @@
+import codecs
+import json
+from array import array
+from typing import BinaryIO
+
+import numpy as np
+
+from lib.columnar import column_store, to_column, to_index
+
+CHUNK_SIZE = 64 * 1024
+
+# Characters that may follow a complete number
+NUMBER_DELIMITERS = " \t\n\r,]}"
+
+
+class InvalidResultsError(ValueError):
+    pass
+
+
+class JSONStreamReader:
+    # Pull parser over a binary stream, only the unread part of the current chunk is kept in memory
+    def __init__(self, file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+
+        chunk = self.file.read(self.chunk_size)
+        try:
+            if not chunk:
+                self.eof = True
+                self.buffer = self.buffer[self.pos :] + self.decoder.decode(b"", final=True)
+            else:
+                self.buffer = self.buffer[self.pos :] + self.decoder.decode(chunk)
+        except UnicodeDecodeError as error:
+            raise InvalidResultsError(f"File is not valid UTF-8: {error}")
+        self.pos = 0
+
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise InvalidResultsError("Unexpected end of file")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise InvalidResultsError(f"Expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def next_separator(self, end: str) -> bool:
+        # Consumes ',' or the closing bracket, returns False once the container is closed
+        char = self.peek()
+        self.pos += 1
+        if char == ",":
+            return True
+        if char == end:
+            return False
+        raise InvalidResultsError(f"Expected ',' or '{end}' at offset {self.pos - 1}")
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as error:
+                if self._fill():
+                    continue
+                raise InvalidResultsError(str(error))
+
+            # A value touching the end of the buffer might be truncated (e.g. a number)
+            if end >= len(self.buffer) and self._fill():
+                continue
+
+            # A number cut inside the chunk ("16." or "1e") decodes as a shorter number, it is only
+            # complete once a delimiter follows
+            if (
+                isinstance(value, (int, float))
+                and end < len(self.buffer)
+                and self.buffer[end] not in NUMBER_DELIMITERS
+            ):
+                if not any(char in NUMBER_DELIMITERS for char in self.buffer[end:]) and self._fill():
+                    continue
+                raise InvalidResultsError(f"Invalid number at offset {self.pos}")
+
+            self.pos = end
+            return value
+
+    def read_string(self) -> str:
+        if self.peek() != '"':
+            raise InvalidResultsError(f"Expected a string at offset {self.pos}")
+        return self.read_value()
+
+
+class ColumnBuilder:
+    # Collects values in compact typed arrays while the column is numeric
+    def __init__(self) -> None:
+        self.values = array("q")
+        self.items: list | None = None
+
+    def append(self, value):
+        if self.items is not None:
+            self.items.append(value)
+        elif isinstance(value, bool) or not isinstance(value, (int, float, type(None))):
+            self.items = self.values.tolist()
+            self.items.append(value)
+        elif self.values.typecode == "q" and isinstance(value, int):
+            try:
+                self.values.append(value)
+            except OverflowError:
+                raise InvalidResultsError(f"Integer {value} does not fit into 64 bits")
+        else:
+            if self.values.typecode == "q":
+                self.values = array("d", self.values)
+            self.values.append(float("nan") if value is None else value)
+
+    def __len__(self) -> int:
+        return len(self.items) if self.items is not None else len(self.values)
+
+    def build(self) -> np.ndarray:
+        if self.items is not None:
+            return to_column(self.items)
+        return np.frombuffer(self.values, dtype=np.int64 if self.values.typecode == "q" else np.float64)
+
+
+class IngestedResults:
+    def __init__(
+        self,
+        index: np.ndarray,
+        columns: dict[str, np.ndarray],
+        metrics: dict,
+        context: str,
+        index_digest: str,
+        column_digests: dict[str, str],
+    ) -> None:
+        self.index = index
+        self.columns = columns
+        self.metrics = metrics
+        self.context = context
+        self.index_digest = index_digest
+        self.column_digests = column_digests
+
+
+def _read_data(reader: JSONStreamReader) -> tuple[np.ndarray, dict[str, np.ndarray], dict[str, str]]:
+    index: list | None = None
+    columns = {}
+    column_digests = {}
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        raise InvalidResultsError("data does not contain any columns")
+
+    while True:
+        name = reader.read_string()
+        reader.expect(":")
+
+        keys = []
+        builder = ColumnBuilder()
+        opening = reader.peek()
+
+        if opening not in "{[":
+            raise InvalidResultsError(f"Column {name} must be an object or a list")
+        reader.pos += 1
+        closing = "}" if opening == "{" else "]"
+
+        if reader.peek() == closing:
+            reader.pos += 1
+        else:
+            while True:
+                key = reader.read_string() if opening == "{" else str(len(builder))
+                if opening == "{":
+                    reader.expect(":")
+
+                value = reader.read_value()
+                if isinstance(value, (dict, list)):
+                    raise InvalidResultsError(f"Column {name} contains a nested value")
+
+                # Every column has to follow the index of the first column
+                position = len(builder)
+                if index is None:
+                    keys.append(key)
+                elif position >= len(index) or index[position] != key:
+                    raise InvalidResultsError(f"Column {name} does not share the index of the other columns")
+
+                builder.append(value)
+
+                if not reader.next_separator(closing):
+                    break
+
+        if index is None:
+            index = keys
+        elif len(builder) != len(index):
+            raise InvalidResultsError(f"Column {name} has {len(builder)} rows, expected {len(index)}")
+
+        # Write the finished column to the store and keep a memory-mapped view instead of the builder
+        digest = column_store.put(builder.build())
+        column_digests[name] = digest
+        columns[name] = column_store.get(digest)
+        del builder
+
+        if not reader.next_separator("}"):
+            break
+
+    return to_index(index or []), columns, column_digests
+
+
+def _validate_metrics(metrics, columns: dict):
+    if not isinstance(metrics, dict):
+        raise InvalidResultsError("metrics must be an object")
+    if not isinstance(metrics.get("Coefficients"), dict):
+        raise InvalidResultsError("metrics.Coefficients must be an object")
+    if not isinstance(metrics.get("Reference"), str):
+        raise InvalidResultsError("metrics.Reference must be a string")
+
+    for column in list(metrics["Coefficients"].keys()) + [metrics["Reference"]]:
+        if column not in columns:
+            raise InvalidResultsError(f"Column {column} used in metrics is missing in data")
+
+
+def ingest_results(file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> IngestedResults:
+    reader = JSONStreamReader(file, chunk_size)
+
+    index = None
+    columns = None
+    column_digests = {}
+    metrics = None
+    context = None
+
+    reader.expect("{")
+    if reader.peek() != "}":
+        while True:
+            key = reader.read_string()
+            reader.expect(":")
+
+            if key == "data":
+                index, columns, column_digests = _read_data(reader)
+            elif key == "metrics":
+                metrics = reader.read_value()
+            elif key == "context":
+                context = reader.read_value()
+                if not isinstance(context, str):
+                    raise InvalidResultsError("context must be a string")
+            else:
+                reader.read_value()
+
+            if not reader.next_separator("}"):
+                break
+    else:
+        reader.pos += 1
+
+    if index is None or columns is None:
+        raise InvalidResultsError("data is missing")
+    if context is None:
+        raise InvalidResultsError("context is missing")
+    _validate_metrics(metrics, columns)
+
+    return IngestedResults(
+        index,
+        columns,
+        metrics,  # type: ignore
+        context,
+        column_store.put(index),
+        column_digests,
+    )
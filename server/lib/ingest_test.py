@@ -0,0 +1,65 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+from lib.columnar import column_store, normalize_data
+from lib.ingest import InvalidResultsError, ingest_results
+
+MODELS_PATH = os.path.join(os.path.dirname(__file__), "..", "models")
+RESULT_FILES = sorted(
+    name for name in os.listdir(MODELS_PATH) if name.endswith("_result.json")
+)
+
+
+@pytest.fixture(autouse=True)
+def temporary_column_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(column_store, "path", str(tmp_path))
+
+
+def ingest(data: bytes, chunk_size: int):
+    return ingest_results(io.BytesIO(data), chunk_size)
+
+
+@pytest.mark.parametrize("name", RESULT_FILES)
+@pytest.mark.parametrize("chunk_size", [7, 333, 1000, 64 * 1024])
+@pytest.mark.parametrize("padding", [0, 1, 5, 13])
+def test_ingest_matches_json_loads(name, chunk_size, padding):
+    with open(os.path.join(MODELS_PATH, name), "rb") as file:
+        data = b" " * padding + file.read()
+
+    expected = json.loads(data)
+    index, columns = normalize_data(expected["data"])
+
+    results = ingest(data, chunk_size)
+
+    assert results.metrics == expected["metrics"]
+    assert results.context == expected["context"]
+    np.testing.assert_array_equal(results.index, index)
+    assert list(results.columns) == list(columns)
+    for column, values in columns.items():
+        np.testing.assert_array_equal(results.columns[column], values)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 64 * 1024])
+def test_numbers_split_across_chunks(chunk_size):
+    data = b'{"data": {"a": [16.5, 1e3, -2, 12345678]}, "context": "", "metrics": {"Coefficients": {}, "Reference": "a"}}'
+
+    results = ingest(data, chunk_size)
+
+    np.testing.assert_array_equal(results.columns["a"], [16.5, 1000.0, -2.0, 12345678.0])
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'{"data": {"a": [16.x]}}',
+        b'{"data": {"a": [1]}, "context": "\xff"}',
+        b'{"data": {"a": [100000000000000000000000]}}',
+    ],
+)
+def test_invalid_files_raise_invalid_results(data):
+    with pytest.raises(InvalidResultsError):
+        ingest(data, 4)
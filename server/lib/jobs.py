@@ -0,0 +1,219 @@
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import WebSocket
+from fastapi.concurrency import run_in_threadpool
+
+from lib.columnar import column_store
+from lib.database import insert_report
+from lib.ingest import IngestedResults
+from lib.results_cache import invalidate_results
+
+JOB_WORKERS = int(os.environ.get("REPORT_JOB_WORKERS", "2"))
+# Finished jobs are kept this long for status requests
+JOB_RETENTION = 60 * 60
+
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _render_report(job_id: str, index_digest: str, column_digests: dict, metrics: dict, context: str) -> bytes:
+    # Runs inside a worker process, the columns are memory-mapped from the column store instead of being pickled
+    from lib.pdf_generator.generate import generate_pdf
+
+    def progress(stage: str):
+        if _progress_queue is not None:
+            _progress_queue.put((job_id, stage))
+
+    results = {
+        "data": {name: column_store.get(digest) for name, digest in column_digests.items()},
+        "metrics": metrics,
+        "context": context,
+    }
+
+    return generate_pdf(f"report_{job_id}", results, progress=progress)
+
+
+class Job:
+    def __init__(self, label: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.status = "queued"
+        self.stage = None
+        self.report_id = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+        self.subscribers: set[asyncio.Queue] = set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "status": self.status,
+            "stage": self.stage,
+            "report_id": self.report_id,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS) -> None:
+        self.workers = workers
+        self.jobs: dict[str, Job] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+        self.loop = None
+        self.executor = None
+        self.progress_queue = None
+        self.progress_thread = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.progress_queue = multiprocessing.Queue()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.progress_queue,),
+        )
+        self.progress_thread = threading.Thread(target=self._relay_progress, daemon=True)
+        self.progress_thread.start()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.progress_queue is not None:
+            self.progress_queue.put(None)
+            self.progress_queue = None
+
+    def _relay_progress(self):
+        # Forwards stage updates of the worker processes to the event loop
+        queue = self.progress_queue
+        while True:
+            item = queue.get()  # type: ignore
+            if item is None:
+                break
+            job_id, stage = item
+            if job_id in self.jobs:
+                self.loop.call_soon_threadsafe(self._progress, self.jobs[job_id], stage)  # type: ignore
+
+    def _progress(self, job: Job, stage: str):
+        # Stage messages travel apart from the job result and may arrive after the job finished,
+        # they only ever change the stage
+        if job.finished:
+            return
+        job.stage = stage
+
+        for queue in job.subscribers:
+            queue.put_nowait(job.to_dict())
+
+    def _update(self, job: Job, status: str, stage: str | None = None):
+        job.status = status
+        if stage:
+            job.stage = stage
+        if job.finished:
+            job.finished_at = time.time()
+
+        for queue in job.subscribers:
+            queue.put_nowait(job.to_dict())
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [
+            job.id
+            for job in self.jobs.values()
+            if job.finished_at and now - job.finished_at > JOB_RETENTION
+        ]:
+            del self.jobs[job_id]
+
+    def submit(self, label: str, ingested: IngestedResults) -> Job:
+        if self.executor is None:
+            raise RuntimeError("Job manager is not started")
+
+        self._prune()
+
+        job = Job(label)
+        self.jobs[job.id] = job
+
+        future = self.loop.run_in_executor(  # type: ignore
+            self.executor,
+            _render_report,
+            job.id,
+            ingested.index_digest,
+            ingested.column_digests,
+            ingested.metrics,
+            ingested.context,
+        )
+        task = asyncio.create_task(self._complete(job, future, ingested))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return job
+
+    async def _complete(self, job: Job, future: asyncio.Future, ingested: IngestedResults):
+        try:
+            pdf = await future
+
+            self._update(job, "running", "storing")
+            job.report_id = await run_in_threadpool(
+                insert_report,
+                job.label,
+                pdf,
+                json.dumps({"metrics": ingested.metrics, "context": ingested.context}),
+                datetime.datetime.now().isoformat(),
+                ingested.index_digest,
+                ingested.column_digests,
+            )
+            invalidate_results(job.report_id)  # type: ignore
+
+            self._update(job, "done")
+        except Exception as error:
+            job.error = str(error)
+            self._update(job, "failed")
+
+    def subscribe(self, socket: WebSocket, job_id: str):
+        # Keeps a reference to the streaming task, like submit does for the completion tasks
+        task = asyncio.create_task(self.stream_progress(socket, job_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    async def stream_progress(self, socket: WebSocket, job_id: str):
+        job = self.get(job_id)
+        if job is None:
+            await socket.send_json({"type": "job_progress", "id": job_id, "error": "Job not found"})
+            return
+
+        queue = asyncio.Queue()
+        job.subscribers.add(queue)
+        try:
+            state = job.to_dict()
+            while True:
+                await socket.send_json({"type": "job_progress", **state})
+                if state["status"] in ("done", "failed"):
+                    break
+                state = await queue.get()
+        finally:
+            job.subscribers.discard(queue)
+
+
+job_manager = JobManager()
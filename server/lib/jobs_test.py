@@ -0,0 +1,63 @@
+import asyncio
+import queue
+import threading
+
+from lib.jobs import Job, JobManager
+
+
+async def run_relay(manager: JobManager, job: Job, outcome: Exception, stages: list[str]):
+    # The worker raises, its stage messages are only relayed after the job result arrived
+    manager.loop = asyncio.get_running_loop()
+    manager.progress_queue = queue.Queue()  # type: ignore
+    manager.jobs[job.id] = job
+
+    subscriber = asyncio.Queue()
+    job.subscribers.add(subscriber)
+
+    future = manager.loop.create_future()
+    future.set_exception(outcome)
+    await manager._complete(job, future, None)  # type: ignore
+
+    relay = threading.Thread(target=manager._relay_progress)
+    relay.start()
+    for stage in stages:
+        manager.progress_queue.put((job.id, stage))  # type: ignore
+    manager.progress_queue.put(None)  # type: ignore
+    relay.join()
+
+    # Let the callbacks scheduled by the relay thread run
+    for _ in range(len(stages) + 1):
+        await asyncio.sleep(0)
+
+    events = []
+    while not subscriber.empty():
+        events.append(subscriber.get_nowait())
+    return events
+
+
+def test_late_progress_does_not_reopen_a_finished_job():
+    manager = JobManager()
+
+    for _ in range(50):
+        job = Job("report")
+        events = asyncio.run(run_relay(manager, job, RuntimeError("boom"), ["plots", "content"]))
+
+        assert job.status == "failed"
+        assert job.finished_at is not None
+        assert manager.get(job.id).to_dict()["status"] == "failed"  # type: ignore
+        assert [event["status"] for event in events] == ["failed"]
+
+
+def test_progress_only_changes_the_stage():
+    async def scenario():
+        manager = JobManager()
+        manager.loop = asyncio.get_running_loop()
+        job = Job("report")
+
+        manager._progress(job, "plots")
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert job.stage == "plots"
+    assert job.status == "queued"
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from lib.file_store import atomic_write, evict_least_recently_used, touch
+
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "256"))
+
+
+def normalize_content(content):
+    # Whitespace in prompts does not change the answer, images are kept as they are
+    if isinstance(content, str):
+        return " ".join(content.split())
+    if isinstance(content, list):
+        return [
+            {**part, "text": " ".join(part["text"].split())}
+            if part.get("type") == "text"
+            else part
+            for part in content
+        ]
+    return content
+
+
+class ResponseCache:
+    # Content addressed on-disk cache, one file per response. Entries expire LLM_CACHE_TTL after they
+    # were written, the file mtime is the last access and only decides which entries are evicted first
+    def __init__(self, path: str, ttl: int, max_entries: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, model: str, messages: list, **params) -> str:
+        normalized = {
+            "model": model,
+            "messages": [
+                {**message, "content": normalize_content(message.get("content"))}
+                for message in messages
+            ],
+            "params": params,
+        }
+        return hashlib.sha256(
+            json.dumps(normalized, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        ).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        file = self._file(key)
+
+        try:
+            with open(file, "r", encoding="utf-8") as handle:
+                entry = json.load(handle)
+
+            # The creation time decides the expiry, the mtime only orders the entries for eviction
+            if not isinstance(entry, dict) or time.time() - entry.get("created_at", 0) > self.ttl:
+                os.remove(file)
+                raise FileNotFoundError(file)
+
+            value = entry["value"]
+            touch(file)
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        atomic_write(self._file(key), json.dumps({"created_at": time.time(), "value": value}))
+        evict_least_recently_used(self.path, ".json", max_entries=self.max_entries)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+response_cache = ResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
@@ -0,0 +1,42 @@
+import os
+import time
+
+from lib.llm_cache import ResponseCache
+
+
+def test_frequent_hits_do_not_extend_the_ttl(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), ttl=10, max_entries=10)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache.set("key", "answer")
+
+    for offset in (4, 8):
+        monkeypatch.setattr(time, "time", lambda: now + offset)
+        assert cache.get("key") == "answer"
+
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("key") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "key.json"))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60, max_entries=2)
+
+    for index, key in enumerate(["a", "b"]):
+        cache.set(key, key)
+        os.utime(os.path.join(str(tmp_path), f"{key}.json"), (index, index))
+
+    cache.get("a")
+    cache.set("c", "c")
+
+    assert cache.get("a") == "a"
+    assert cache.get("b") is None
+    assert cache.get("c") == "c"
+
+
+def test_entries_of_the_old_format_are_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60, max_entries=2)
+    with open(os.path.join(str(tmp_path), "old.json"), "w", encoding="utf-8") as handle:
+        handle.write('{"title": "plain response"')
+
+    assert cache.get("old") is None
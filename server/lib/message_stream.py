@@ -0,0 +1,80 @@
+import hashlib
+import time
+
+from fastapi import WebSocket
+
+# Tokens arriving within this window are sent as one frame
+COALESCE_INTERVAL = 0.04
+
+
+# Sends a streamed answer over the websocket.
+# - protocol "full": every frame carries the accumulated message (legacy clients)
+# - protocol "delta": frames only carry the new text with a sequence number,
+#   the final frame carries the full text and its sha256 checksum
+class MessageSender:
+    def __init__(
+        self,
+        socket: WebSocket,
+        protocol: str = "full",
+        interval: float = COALESCE_INTERVAL,
+    ) -> None:
+        self.socket = socket
+        self.protocol = protocol
+        self.interval = interval
+
+        self.parts = []
+        self.length = 0
+        self.pending = []
+        self.seq = 0
+        self.last_flush = time.monotonic()
+
+    @property
+    def message(self) -> str | None:
+        return "".join(self.parts) if self.parts else None
+
+    async def push(self, content: str):
+        self.parts.append(content)
+        self.length += len(content)
+        self.pending.append(content)
+
+        if time.monotonic() - self.last_flush >= self.interval:
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+
+        if self.protocol == "delta":
+            await self.socket.send_json(
+                {
+                    "type": "message_delta",
+                    "delta": "".join(self.pending),
+                    "seq": self.seq,
+                }
+            )
+        else:
+            await self.socket.send_json(
+                {
+                    "type": "message",
+                    "message": self.message,
+                    "isFinished": False,
+                }
+            )
+
+        self.seq += 1
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+    async def finish(self):
+        await self.flush()
+
+        message = self.message
+        frame = {"type": "message", "message": message, "isFinished": True}
+
+        if self.protocol == "delta":
+            frame["seq"] = self.seq
+            frame["checksum"] = hashlib.sha256(
+                (message or "").encode("utf-8")
+            ).hexdigest()
+
+        await self.socket.send_json(frame)
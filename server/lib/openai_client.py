@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+
+import httpx
+from openai import AsyncClient, Client
+
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "120"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2 = os.environ.get("OPENAI_HTTP2", "1") == "1"
+except ImportError:
+    HTTP2 = False
+
+_clients: dict[str, Client] = {}
+_async_clients: dict[tuple[str, int], AsyncClient] = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Pooled sockets must not be shared with forked worker processes
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+    _async_clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client(api_key: str) -> Client:
+    # One client per api key and process, connections are kept alive between requests
+    with _lock:
+        if api_key not in _clients:
+            _clients[api_key] = Client(
+                api_key=api_key,
+                timeout=_timeout(),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=httpx.Client(
+                    limits=_limits(), timeout=_timeout(), http2=HTTP2
+                ),
+            )
+        return _clients[api_key]
+
+
+def get_async_client(api_key: str) -> AsyncClient:
+    # Async connection pools belong to an event loop, so there is one client per loop
+    key = (api_key, id(asyncio.get_running_loop()))
+    with _lock:
+        if key not in _async_clients:
+            _async_clients[key] = AsyncClient(
+                api_key=api_key,
+                timeout=_timeout(),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=httpx.AsyncClient(
+                    limits=_limits(), timeout=_timeout(), http2=HTTP2
+                ),
+            )
+        return _async_clients[key]
+
+
+async def close_clients():
+    with _lock:
+        clients = list(_clients.values())
+        async_clients = list(_async_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+
+    for client in clients:
+        client.close()
+    for async_client in async_clients:
+        await async_client.close()
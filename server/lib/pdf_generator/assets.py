@@ -0,0 +1,37 @@
+import base64
+import os
+from pathlib import Path
+
+ASSET_DIRECTORY = Path(__file__).parent / "images"
+# "file" references the images on disk, "inline" embeds them as data URIs (for renderers without local file access)
+ASSET_MODE = os.environ.get("PDF_ASSET_MODE", "file")
+
+
+class AssetRegistry:
+    def __init__(self, directory: Path, mode: str) -> None:
+        self.directory = directory
+        self.mode = mode
+        self.urls: dict[str, str] = {}
+
+    def _load(self, name: str) -> str:
+        path = (self.directory / name).resolve()
+
+        if self.mode == "file":
+            return path.as_uri()
+
+        image_type = path.suffix.lstrip(".").replace("jpg", "jpeg")
+        image_bytes = base64.b64encode(path.read_bytes()).decode("utf-8")
+        return f"data:image/{image_type};base64,{image_bytes}"
+
+    def url(self, name: str) -> str:
+        if name not in self.urls:
+            self.urls[name] = self._load(name)
+        return self.urls[name]
+
+    def preload(self):
+        for path in self.directory.iterdir():
+            if path.is_file():
+                self.url(path.name)
+
+
+assets = AssetRegistry(ASSET_DIRECTORY, ASSET_MODE)
@@ -1,62 +1,31 @@
-import base64
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import json
-import pdfkit
-from pathlib import Path
-import openai
-import matplotlib.pyplot as plt
+import time
 from dotenv import load_dotenv
 import os
 from bs4 import BeautifulSoup
 
-load_dotenv("../.env")
-
-client = openai.Client(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
+from lib.llm_cache import response_cache
+from lib.openai_client import get_client
+from lib.pdf_generator.assets import assets
+from lib.pdf_generator.renderer import get_renderer
+from lib.plotting import bar_plot_png, get_bynd_color, png_base64, scatter_plot_png
 
+load_dotenv("../.env")
 
-def get_bynd_color(index):
-    colors = ["#5B7F9E", "#A5C2E8", "#EBDC03", "#F69B00", "#AAC001"]
-    return colors[index % len(colors)]
-
+# Template images are resolved once per process
+assets.preload()
 
-def load_image(image_path, image_type="jpeg"):
-    image = Path("./lib/pdf_generator" + image_path).read_bytes()
-    images_bytes = base64.b64encode(image).decode("utf-8")
-    return f"data:image/{image_type};base64,{images_bytes}"
+PLOT_WORKERS = int(os.environ.get("PLOT_WORKERS", "4"))
 
 
 def scatter_plot_bytes(x, y, xLabel="", yLabel="", color="#6da7cd"):
-    plt.clf()
-    plt.scatter(x, y, color=color)
-    plt.xlabel(xLabel)
-    plt.ylabel(yLabel)
-
-    plt.savefig("tmp.png")
-    with open("tmp.png", "rb") as file:
-        plot_bytes = base64.b64encode(file.read()).decode("utf-8")
-
-    return plot_bytes
+    return png_base64(scatter_plot_png(x, y, xLabel, yLabel, color))
 
 
 def bar_plot_bytes(x, y, xLabel="", yLabel=""):
-    plt.clf()
-    barlist = plt.bar(x, y, color="#6da7cd")
-
-    for i in range(len(barlist)):
-        bar = barlist[i]
-        bar.set_color(get_bynd_color(i))
-
-    plt.ylabel(yLabel)
-    plt.xlabel(xLabel)
-    plt.gca().axes.get_xaxis().set_ticklabels([])
-
-    plt.savefig("tmp.png")
-    with open("tmp.png", "rb") as file:
-        plot_bytes = base64.b64encode(file.read()).decode("utf-8")
-
-    return plot_bytes
+    return png_base64(bar_plot_png(x, y, xLabel, yLabel))
 
 
 def generate_content(results, images=[]):
@@ -122,50 +91,85 @@ def generate_content(results, images=[]):
             }
         )
 
-    response = client.chat.completions.create(
+    messages = [
+        {
+            "role": "user",
+            "content": content,
+        },
+    ]
+
+    # Uploading the same results again produces the same request, reuse the stored answer
+    cache_key = response_cache.key(
+        "gpt-4-turbo", messages, response_format="json_object"
+    )
+    cached_content = response_cache.get(cache_key)
+    if cached_content is not None:
+        print(f"Report content cache hit {response_cache.stats()}")
+        return cached_content
+
+    response = get_client(os.environ["OPENAI_API_KEY"]).chat.completions.create(
         model="gpt-4-turbo",
         response_format={"type": "json_object"},
-        messages=[
-            {
-                "role": "user",
-                "content": content,
-            },
-        ],
+        messages=messages,  # type: ignore
     )
 
-    return response.choices[0].message.content
+    response_content = response.choices[0].message.content
+    if response_content:
+        response_cache.set(cache_key, response_content)
 
+    print(f"Report content cache miss {response_cache.stats()}")
 
-def generate_pdf(filename, results):
+    return response_content
 
-    for data_key in results["data"]:
-        results["data"][data_key] = [
-            results["data"][data_key][key] for key in results["data"][data_key]
-        ]
+
+def generate_pdf(filename, results, progress=None):
+    start = time.perf_counter()
+
+    if progress:
+        progress("plots")
 
     used_metrics = results["metrics"]["Coefficients"].keys()
     reference_metric = results["metrics"]["Reference"]
 
-    plots = [
-        scatter_plot_bytes(
-            results["data"][metric],
-            results["data"][reference_metric],
-            metric,
+    # All plots of the report are rendered concurrently, the pool only lives for this report because
+    # generate_pdf itself runs inside a job worker process
+    plots_start = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(PLOT_WORKERS, len(used_metrics) + 1))
+    ) as pool:
+        plot_futures = [
+            pool.submit(
+                scatter_plot_bytes,
+                results["data"][metric],
+                results["data"][reference_metric],
+                metric,
+                reference_metric,
+                color=get_bynd_color(i),
+            )
+            for i, metric in enumerate(used_metrics)
+        ]
+
+        coefficients_bar_future = pool.submit(
+            bar_plot_bytes,
+            list(results["metrics"]["Coefficients"].keys()),
+            list(results["metrics"]["Coefficients"].values()),
+            None,
             reference_metric,
-            color=get_bynd_color(i),
         )
-        for i, metric in enumerate(used_metrics)
-    ]
 
-    coefficients_bar = bar_plot_bytes(
-        results["metrics"]["Coefficients"].keys(),
-        results["metrics"]["Coefficients"].values(),
-        None,
-        reference_metric,
+        plots = [future.result() for future in plot_futures]
+        coefficients_bar = coefficients_bar_future.result()
+
+    print(
+        f"Rendered {len(plots) + 1} plots for {filename} in {time.perf_counter() - plots_start:.2f}s"
     )
 
     coefficients_colors = [get_bynd_color(i) for i in range(len(used_metrics))]
 
+    if progress:
+        progress("content")
+
     # with open("tmp_content.json", "r") as file:
     raw_content = generate_content(
         results,
@@ -207,16 +211,16 @@ def generate_pdf(filename, results):
         </head>
         <body>
           <header class="page-break large">
-            <img class="first" src="{load_image('/images/bg-header.png', 'png')}" id="bg" />
-            <img class="second" src="{load_image('/images/bg-header.png', 'png')}" id="bg" />
-            <img src="{load_image('/images/bynd-logo-white.png', 'png')}" width="120" />
+            <img class="first" src="{assets.url('bg-header.png')}" id="bg" />
+            <img class="second" src="{assets.url('bg-header.png')}" id="bg" />
+            <img src="{assets.url('bynd-logo-white.png')}" width="120" />
             <h1>{content["title"]}</h1>
             <h2>{content["subtitle"]}</h2>
             <p>{date}</p>
           </header>
           <div class="main">
             <section id="intro">
-              <img id="outline" src="{load_image('/images/logo-outline.png', 'png')}" width="100%" />
+              <img id="outline" src="{assets.url('logo-outline.png')}" width="100%" />
               <h3>Introduction</h3>
               <p>{content["introduction"]}</p>
             </section>
@@ -231,8 +235,8 @@ def generate_pdf(filename, results):
             </section>
           </div>
           <header class="page-break small">
-            <img src="{load_image('/images/bg-header.png', 'png')}" id="bg" />
-            <img src="{load_image('/images/bynd-logo-white.png', 'png')}" width="120" />
+            <img src="{assets.url('bg-header.png')}" id="bg" />
+            <img src="{assets.url('bynd-logo-white.png')}" width="120" />
             <h1>{content["title"]}</h1>
             <h2>{content["subtitle"]}</h2>
           </header>
@@ -268,6 +272,9 @@ def generate_pdf(filename, results):
         </html>
       """
 
+    if progress:
+        progress("render")
+
     options = {
         "page-size": "A4",
         "margin-top": "0.0in",
@@ -276,9 +283,14 @@ def generate_pdf(filename, results):
         "margin-left": "0.0in",
     }
 
-    pdfkit.from_string(
-        body,
-        f"{filename}.pdf",
-        css="./lib/pdf_generator/style.css",
-        options=options,
+    if assets.mode == "file":
+        options["enable-local-file-access"] = ""
+
+    renderer = get_renderer()
+    pdf = renderer.render(body, options)
+
+    print(
+        f"Generated report {filename} in {time.perf_counter() - start:.2f}s ({renderer.name})"
     )
+
+    return pdf
@@ -0,0 +1,103 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import pdfkit
+
+STYLESHEET = Path(__file__).parent / "style.css"
+# "wkhtmltopdf" or "weasyprint"
+PDF_RENDERER = os.environ.get("PDF_RENDERER", "wkhtmltopdf")
+
+
+class PdfRenderer(ABC):
+    name = ""
+
+    @abstractmethod
+    def render(self, html: str, options: dict) -> bytes: ...
+
+    def close(self):
+        pass
+
+
+class WkhtmltopdfRenderer(PdfRenderer):
+    name = "wkhtmltopdf"
+
+    def __init__(self) -> None:
+        # Resolving the binary is done once, the stylesheet is read by wkhtmltopdf from disk instead of being inlined
+        self.configuration = pdfkit.configuration()
+
+    def render(self, html: str, options: dict) -> bytes:
+        return pdfkit.from_string(
+            html,
+            False,
+            options={**options, "user-style-sheet": str(STYLESHEET)},
+            configuration=self.configuration,
+        )
+
+
+class WeasyPrintRenderer(PdfRenderer):
+    # In-process engine, the parsed stylesheet and fonts stay warm for the lifetime of the worker process
+    name = "weasyprint"
+
+    def __init__(self) -> None:
+        try:
+            import weasyprint
+            from weasyprint.text.fonts import FontConfiguration
+        except ImportError:
+            raise RuntimeError("PDF_RENDERER=weasyprint requires the weasyprint package")
+
+        self.weasyprint = weasyprint
+        self.font_config = FontConfiguration()
+        self.stylesheet = weasyprint.CSS(filename=str(STYLESHEET), font_config=self.font_config)
+        self.page_styles = {}
+
+    def _page_style(self, options: dict):
+        # Translates the wkhtmltopdf page options into an @page rule
+        key = tuple(sorted(options.items()))
+        if key not in self.page_styles:
+            margins = " ".join(
+                options.get(f"margin-{side}", "0")
+                for side in ("top", "right", "bottom", "left")
+            )
+            self.page_styles[key] = self.weasyprint.CSS(
+                string=f"@page {{ size: {options.get('page-size', 'A4')}; margin: {margins}; }}",
+                font_config=self.font_config,
+            )
+        return self.page_styles[key]
+
+    def render(self, html: str, options: dict) -> bytes:
+        return self.weasyprint.HTML(string=html, base_url=str(STYLESHEET.parent)).write_pdf(
+            stylesheets=[self.stylesheet, self._page_style(options)],
+            font_config=self.font_config,
+        )
+
+
+RENDERERS = {
+    WkhtmltopdfRenderer.name: WkhtmltopdfRenderer,
+    WeasyPrintRenderer.name: WeasyPrintRenderer,
+}
+
+_renderers: dict[str, PdfRenderer] = {}
+
+
+def get_renderer(name: str = PDF_RENDERER) -> PdfRenderer:
+    # One renderer per process, report job workers keep it between reports
+    if name not in RENDERERS:
+        raise ValueError(f"Unknown PDF renderer: {name}")
+    if name not in _renderers:
+        _renderers[name] = RENDERERS[name]()
+    return _renderers[name]
+
+
+def benchmark(html: str, options: dict, names: list[str] = list(RENDERERS), runs: int = 5) -> dict:
+    timings = {}
+    for name in names:
+        renderer = get_renderer(name)
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            renderer.render(html, options)
+            durations.append(time.perf_counter() - start)
+        timings[name] = {"min": min(durations), "mean": sum(durations) / len(durations)}
+    return timings
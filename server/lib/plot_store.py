@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import threading
+
+from lib.file_store import atomic_write, evict_least_recently_used, touch
+
+PLOT_STORE_PATH = os.environ.get("PLOT_STORE_PATH", "static/plots")
+PLOT_STORE_MAX_BYTES = int(os.environ.get("PLOT_STORE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+class PlotStore:
+    # Content addressed rendered plots, identical requests share one file, file mtime is the last access.
+    # Next to every artifact a small recipe (the parameters it was rendered from) is kept, so an evicted
+    # plot that is still referenced (e.g. by a cached answer) can be rendered again on request.
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.rendering = {}
+
+    def key(self, **params) -> str:
+        return hashlib.sha256(
+            json.dumps(params, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        ).hexdigest()
+
+    def is_key(self, key: str) -> bool:
+        return len(key) == 64 and all(char in "0123456789abcdef" for char in key)
+
+    def name(self, key: str, extension: str = "png") -> str:
+        return f"{key}.{extension}"
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def recipe(self, key: str) -> dict | None:
+        try:
+            with open(self.file(f"{key}.recipe.json"), "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get_or_render(self, key: str, render, recipe: dict, extension: str = "png") -> str:
+        # Returns the file name of the artifact, render() is only called when it is not stored yet
+        name = self.name(key, extension)
+        file = self.file(name)
+
+        with self.lock:
+            lock = self.rendering.setdefault(name, threading.Lock())
+
+        # Concurrent requests for the same plot wait for the first render instead of repeating it
+        try:
+            with lock:
+                if touch(file):
+                    return name
+
+                data = render()
+
+                atomic_write(self.file(f"{key}.recipe.json"), json.dumps(recipe))
+                atomic_write(file, data)
+        finally:
+            with self.lock:
+                self.rendering.pop(name, None)
+
+        # Recipes are tiny and stay, only the artifacts count against the size limit
+        evict_least_recently_used(self.path, f".{extension}", max_bytes=self.max_bytes, keep=name)
+        return name
+
+
+plot_store = PlotStore(PLOT_STORE_PATH, PLOT_STORE_MAX_BYTES)
@@ -0,0 +1,80 @@
+import base64
+import io
+
+import numpy as np
+
+from matplotlib.figure import Figure
+
+from lib.downsample import SCATTER_MAX_POINTS, scatter_points, stratified_sample, use_hexbin
+
+# Plots are drawn on standalone Figure objects, no global pyplot state is shared between renders
+
+
+def get_bynd_color(index):
+    colors = ["#5B7F9E", "#A5C2E8", "#EBDC03", "#F69B00", "#AAC001"]
+    return colors[index % len(colors)]
+
+
+def figure_png(figure: Figure, dpi=None) -> bytes:
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=dpi if dpi else "figure")
+    return buffer.getvalue()
+
+
+def png_base64(png: bytes) -> str:
+    return base64.b64encode(png).decode("utf-8")
+
+
+def scatter_plot_png(
+    x, y, xLabel="", yLabel="", color="#6da7cd", dpi=None, max_points=SCATTER_MAX_POINTS
+) -> bytes:
+    figure = Figure()
+    axes = figure.subplots()
+
+    # Render time stays constant for large results, very large ones are drawn as a density plot
+    if use_hexbin(x, y):
+        axes.hexbin(x, y, gridsize=80, bins="log", mincnt=1, cmap="Blues")
+    else:
+        axes.scatter(*scatter_points(x, y, max_points), color=color)
+    axes.set_xlabel(xLabel)
+    axes.set_ylabel(yLabel)
+
+    return figure_png(figure, dpi)
+
+
+def bar_plot_png(x, y, xLabel="", yLabel="", dpi=None) -> bytes:
+    figure = Figure()
+    axes = figure.subplots()
+    barlist = axes.bar(x, y, color="#6da7cd")
+
+    for i in range(len(barlist)):
+        bar = barlist[i]
+        bar.set_color(get_bynd_color(i))
+
+    axes.set_ylabel(yLabel)
+    axes.set_xlabel(xLabel)
+    axes.get_xaxis().set_ticklabels([])
+
+    return figure_png(figure, dpi)
+
+
+def _axis(label, values: np.ndarray) -> dict:
+    if len(values) == 0:
+        return {"label": label, "min": 0.0, "max": 0.0}
+    return {"label": label, "min": float(values.min()), "max": float(values.max())}
+
+
+def scatter_plot_data(x, y, xLabel="", yLabel="", color="#6da7cd", max_points=2000) -> dict:
+    # Plot description for client side rendering, large series are downsampled by density
+    total = len(x)
+    x, y = stratified_sample(x, y, max_points)
+
+    return {
+        "kind": "scatter",
+        "x": x.tolist(),
+        "y": y.tolist(),
+        "total": total,
+        "color": color,
+        "x_axis": _axis(xLabel, x),
+        "y_axis": _axis(yLabel, y),
+    }
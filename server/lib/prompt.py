@@ -1,10 +1,22 @@
 import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum
 import json
 import threading
-from typing import Literal, TypedDict, Union
+from typing import AsyncIterator, Literal, TypedDict, Union
 
-from openai import Client, AsyncStream, NotGiven
+from openai import AsyncClient, Client, AsyncStream, NotGiven
+
+from lib.context_window import ContextWindow
+from lib.openai_client import get_async_client, get_client
+from lib.prompt_templates import CompiledTemplate, prompt_templates
+from lib.completion_cache import (
+    CachedCompletion,
+    compact_chunks,
+    completion_cache,
+    completion_key,
+)
 
 
 class Model(Enum):
@@ -45,39 +57,87 @@ class AIResponse(TypedDict):
     content: str | None
 
 
-PromptStreamChunk = Union[ToolCall, AIResponse]
+class ToolResult(TypedDict):
+    type: Literal["tool_result"]
+    name: str
+    ok: bool
+
+
+PromptStreamChunk = Union[ToolCall, ToolResult, AIResponse]
+
+
+class PromptStreamCancelled(Exception):
+    pass
 
 
 class PromptStream:
-    def __init__(self):
-        self.data = []
-        self.index = 0
+    # Bounded queue between the prompt thread and the consumer, consumed chunks are released right away
+    def __init__(self, maxsize: int = 256):
+        self.buffer = deque()
+        self.maxsize = maxsize
         self.lock = threading.Lock()
-        self.condition = threading.Condition(lock=self.lock)
+        self.not_empty = threading.Condition(lock=self.lock)
+        self.not_full = threading.Condition(lock=self.lock)
         self.stream_open = True
+        self.cancelled = False
+        self.error: BaseException | None = None
 
     def __iter__(self):
         return self
 
     def __next__(self) -> PromptStreamChunk:
         with self.lock:
-            while self.index >= len(self.data) and self.stream_open:
-                self.condition.wait()
-            if self.index >= len(self.data):
+            while len(self.buffer) == 0 and self.stream_open:
+                self.not_empty.wait()
+            if len(self.buffer) == 0:
+                if self.error:
+                    error, self.error = self.error, None
+                    raise error
                 raise StopIteration
-            value = self.data[self.index]
-            self.index += 1
+            value = self.buffer.popleft()
+            self.not_full.notify()
             return value
 
     def add_data(self, data):
         with self.lock:
-            self.data.append(data)
-            self.condition.notify()
+            if self.cancelled:
+                raise PromptStreamCancelled()
+
+            # A slow consumer gets larger text chunks instead of an ever growing buffer
+            if len(self.buffer) >= self.maxsize and self._can_merge(data):
+                last = self.buffer[-1]
+                self.buffer[-1] = {**last, "content": last["content"] + data["content"]}
+                return
+
+            while len(self.buffer) >= self.maxsize and not self.cancelled:
+                self.not_full.wait()
+            if self.cancelled:
+                raise PromptStreamCancelled()
+
+            self.buffer.append(data)
+            self.not_empty.notify()
+
+    def _can_merge(self, data) -> bool:
+        if data["type"] != "ai_response" or data["content"] is None:
+            return False
+        last = self.buffer[-1]
+        return last["type"] == "ai_response" and last["content"] is not None
+
+    def close_stream(self, error: BaseException | None = None):
+        with self.lock:
+            self.stream_open = False
+            self.error = error
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
 
-    def close_stream(self):
+    def cancel(self):
+        # Stops the producer at its next chunk and drops everything that was not consumed yet
         with self.lock:
+            self.cancelled = True
             self.stream_open = False
-            self.condition.notify_all()
+            self.buffer.clear()
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
 
 
 class PromptGeneratorAnswer:
@@ -91,7 +151,7 @@ class PromptGenerator:
         self,
         prompt: str,
         response_structure: str | dict | None = None,
-        messages: list = [],
+        messages: list | None = None,
         model: Model = Model.GPT_35_TURBO,
         persona: Persona | None = None,
         answerStyle: AnswerStyle | None = None,
@@ -99,10 +159,18 @@ class PromptGenerator:
         tools: list = [],
         functions: dict = {},
         plain: bool = False,
+        use_cache: bool = True,
+        max_rounds: int = 5,
+        tool_timeout: float = 30,
+        client: Client | None = None,
+        async_client: AsyncClient | None = None,
+        context_window: ContextWindow | None = None,
+        pinned_instructions: bool = False,
+        cache_scope: str | None = None,
     ) -> None:
         self.prompt = prompt
         self.response_structure = response_structure
-        self.messages = messages
+        self.messages = messages if messages is not None else []
         self.model = model
         self.persona = persona
         self.answerStyle = answerStyle
@@ -110,10 +178,21 @@ class PromptGenerator:
         self.tools = tools
         self.functions = functions
         self.plain = plain
-
-        self.client = None
+        self.use_cache = use_cache
+        self.max_rounds = max_rounds
+        self.tool_timeout = tool_timeout
+
+        self.client = client
+        self.async_client = async_client
+        self.context_window = context_window
+        # The instructions are already part of the history (see instructions()), the user turn only carries the prompt
+        self.pinned_instructions = pinned_instructions
+        # Answers are only shared between generators of the same scope (e.g. the report a chat is about)
+        self.cache_scope = cache_scope
         self.stream = PromptStream()
         self.image_bytes = []
+        # Messages added while answering, the shared history may be trimmed in between
+        self.added_messages = []
 
     def run(self, api_key: str, imagesBytes: list = []):
         prompt_thread = threading.Thread(
@@ -127,15 +206,72 @@ class PromptGenerator:
 
         return self.stream
 
-    def _execute_prompt(self, api_key: str, imagesBytes: list):
+    async def arun(
+        self, api_key: str, imagesBytes: list = []
+    ) -> AsyncIterator[PromptStreamChunk]:
+        client = self.async_client or get_async_client(api_key)
+
+        self._append_prompt_message(imagesBytes)
+
+        cache_key = self._cache_key() if self.use_cache else None
+        cached = completion_cache.get(cache_key) if cache_key else None
+
+        # Replay a cached answer as a stream, the consumer can not tell the difference
+        if cached is not None:
+            self.messages.extend(cached.messages)
+            for chunk in cached.chunks:
+                yield chunk
+            return
 
-        client = Client(
-            api_key=api_key,
+        chunks = []
+
+        async for chunk in self._arun_prompt(client):
+            chunks.append(chunk)
+            yield chunk
+
+        if cache_key:
+            completion_cache.set(
+                cache_key,
+                CachedCompletion(
+                    compact_chunks(chunks), self.added_messages
+                ),
+            )
+
+    def _cache_key(self) -> str:
+        return completion_key(
+            self.model.value,
+            {
+                "persona": self.persona.value if self.persona else None,
+                "answerStyle": self.answerStyle.value if self.answerStyle else None,
+                "format": self.format.value if self.format else None,
+                "response_structure": self.response_structure,
+                "plain": self.plain,
+                "pinned_instructions": self.pinned_instructions,
+                "cache_scope": self.cache_scope,
+            },
+            self.tools,
+            self.messages,
         )
 
-        if len(imagesBytes) > 0 and (
-            self.model != Model.GPT_4_TURBO or self.model != Model.GPT_4
-        ):
+    def _execute_prompt(self, api_key: str, imagesBytes: list):
+
+        try:
+            client = self.client or get_client(api_key)
+
+            self._append_prompt_message(imagesBytes)
+
+            self._run_prompt(client, self.stream)
+        except PromptStreamCancelled:
+            return
+        except Exception as error:
+            # The consumer re-raises the error instead of waiting for chunks forever
+            self.stream.close_stream(error)
+            return
+
+        self.stream.close_stream()
+
+    def _append_prompt_message(self, imagesBytes: list):
+        if len(imagesBytes) > 0 and self.model not in (Model.GPT_4_TURBO, Model.GPT_4):
             raise ValueError(
                 "Images are only supported for GPT-4 model. Please use GPT-4 model."
             )
@@ -155,94 +291,217 @@ class PromptGenerator:
 
         self.messages.append({"role": "user", "content": content})
 
-        self._run_prompt(client, self.stream)
+    def _run_prompt(self, client: Client, stream: PromptStream):
+        for round in range(self.max_rounds):
+            response = client.chat.completions.create(
+                **self._completion_params(last_round=round == self.max_rounds - 1)
+            )
 
-        self.stream.close_stream()
+            function_calls = {}
 
-    def _run_prompt(self, client: Client, stream: PromptStream):
-        response = client.chat.completions.create(
-            model=self.model.value,
-            messages=self.messages,
-            tools=self.tools if len(self.tools) > 0 else NotGiven(),
-            response_format={
-                "type": "json_object" if self.format == Format.JSON else "text"
-            },
-            stream=True,
-        )
+            for chunk in response:
+                delta = chunk.choices[0].delta
+
+                if delta.tool_calls:
+                    self._collect_tool_calls(function_calls, delta.tool_calls)
 
-        function_calls = {}
-        message = None
-
-        for chunk in response:
-            delta = chunk.choices[0].delta
-
-            if delta.tool_calls:
-                if delta.role:
-                    self.messages.append(delta)
-                    tool_calls = delta.tool_calls
-                    function_calls = {
-                        tool_call.index: {
-                            "id": tool_call.id,
-                            "name": tool_call.function.name,
-                            "args": tool_call.function.arguments,
+                if chunk.choices[0].finish_reason == "tool_calls":
+                    break
+
+                if delta.tool_calls == None:
+                    stream.add_data(
+                        {
+                            "type": "ai_response",
+                            "content": delta.content,
                         }
-                        for tool_call in tool_calls
-                        if tool_call.function
-                    }
-                else:
-                    for tool_call in delta.tool_calls:
-
-                        if tool_call.index in function_calls.keys():
-                            if (
-                                tool_call.function == None
-                                or tool_call.function.arguments == None
-                            ):
-                                continue
-                            if (
-                                function_calls[tool_call.index] == None
-                                or function_calls[tool_call.index]["args"] == None
-                            ):
-                                function_calls[tool_call.index][
-                                    "args"
-                                ] = tool_call.function.arguments
-                            else:
-                                function_calls[tool_call.index]["args"] += tool_call.function.arguments  # type: ignore
-
-            if chunk.choices[0].finish_reason == "tool_calls":
-                break
-
-            if delta.tool_calls == None:
-                self.stream.add_data(
-                    {
-                        "type": "ai_response",
-                        "content": delta.content,
-                    }
-                )
+                    )
+
+            if len(function_calls.keys()) == 0:
+                return
+
+            calls = self._start_tool_calls(function_calls)
+            for name, args, _ in calls:
+                stream.add_data({"type": "tool_call", "name": name, "args": args})
+
+            # Independent tool calls run concurrently, results are reported as they finish
+            tool_responses = {}
+            executor = ThreadPoolExecutor(max_workers=len(calls))
+            futures = {
+                executor.submit(self._handle_tool_call, name, args): index
+                for index, (name, args, _) in enumerate(calls)
+            }
+            try:
+                for future in as_completed(futures, timeout=self.tool_timeout):
+                    index = futures[future]
+                    tool_responses[index] = self._tool_outcome(future)
+                    stream.add_data(
+                        self._tool_result_chunk(calls[index][0], tool_responses[index])
+                    )
+            except TimeoutError:
+                for index, (name, _, _) in enumerate(calls):
+                    if index not in tool_responses:
+                        tool_responses[index] = self._timeout_response()
+                        stream.add_data(
+                            self._tool_result_chunk(name, tool_responses[index])
+                        )
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+            for index, (name, _, call_id) in enumerate(calls):
+                self._append_tool_response(call_id, name, tool_responses[index])
+
+    async def _arun_prompt(
+        self, client: AsyncClient
+    ) -> AsyncIterator[PromptStreamChunk]:
+        for round in range(self.max_rounds):
+            response = await client.chat.completions.create(
+                **self._completion_params(last_round=round == self.max_rounds - 1)
+            )
 
-        if len(function_calls.keys()) > 0:
-            for index in function_calls:
+            function_calls = {}
 
-                func_call = function_calls[index]
+            async for chunk in response:
+                delta = chunk.choices[0].delta
 
-                name = func_call["name"] if func_call["name"] else ""
-                args = json.loads(func_call["args"] if func_call["args"] else "{}")
-                call_id = func_call["id"] if func_call["id"] else ""
+                if delta.tool_calls:
+                    self._collect_tool_calls(function_calls, delta.tool_calls)
 
-                self.stream.add_data({"type": "tool_call", "name": name, "args": args})
+                if chunk.choices[0].finish_reason == "tool_calls":
+                    break
 
-                tool_response = self._handle_tool_call(name, args)
+                if delta.tool_calls == None:
+                    yield {
+                        "type": "ai_response",
+                        "content": delta.content,
+                    }
 
-                self.messages.append(
+            if len(function_calls.keys()) == 0:
+                return
+
+            calls = self._start_tool_calls(function_calls)
+            for name, args, _ in calls:
+                yield {"type": "tool_call", "name": name, "args": args}
+
+            # Independent tool calls run concurrently in worker threads, results are reported as they finish
+            tool_responses = {}
+            pending = [
+                asyncio.ensure_future(self._acall_tool(index, name, args))
+                for index, (name, args, _) in enumerate(calls)
+            ]
+            for next_result in asyncio.as_completed(pending):
+                index, tool_response = await next_result
+                tool_responses[index] = tool_response
+                yield self._tool_result_chunk(calls[index][0], tool_response)
+
+            for index, (name, _, call_id) in enumerate(calls):
+                self._append_tool_response(call_id, name, tool_responses[index])
+
+    async def _acall_tool(self, index: int, name: str, args: dict) -> tuple[int, dict]:
+        try:
+            result = await asyncio.wait_for(
+                asyncio.to_thread(self._handle_tool_call, name, args),
+                self.tool_timeout,
+            )
+        except asyncio.TimeoutError:
+            return index, self._timeout_response()
+        except Exception as error:
+            return index, {"error": str(error)}
+
+        return index, {"result": result}
+
+    def _start_tool_calls(self, function_calls: dict) -> list[tuple[str, dict, str]]:
+        self._append_tool_call_message(function_calls)
+        return [self._parse_tool_call(function_calls[index]) for index in function_calls]
+
+    def _tool_outcome(self, future) -> dict:
+        try:
+            return {"result": future.result()}
+        except Exception as error:
+            return {"error": str(error)}
+
+    def _timeout_response(self) -> dict:
+        return {"error": f"Tool call timed out after {self.tool_timeout} seconds"}
+
+    def _tool_result_chunk(self, name: str, tool_response: dict) -> ToolResult:
+        return {"type": "tool_result", "name": name, "ok": "error" not in tool_response}
+
+    def _completion_params(self, last_round: bool = False) -> dict:
+        # Trims the shared history in place, so the stored conversation stays within the budget as well
+        if self.context_window:
+            self.messages[:] = self.context_window.fit(self.messages)
+
+        return {
+            "model": self.model.value,
+            "messages": self.messages,
+            "tools": self.tools if len(self.tools) > 0 else NotGiven(),
+            # The last allowed round has to answer instead of calling further tools
+            "tool_choice": "none" if last_round and len(self.tools) > 0 else NotGiven(),
+            "response_format": {
+                "type": "json_object" if self.format == Format.JSON else "text"
+            },
+            "stream": True,
+        }
+
+    def _collect_tool_calls(self, function_calls: dict, tool_calls: list):
+        for tool_call in tool_calls:
+            if tool_call.index not in function_calls:
+                if not tool_call.function:
+                    continue
+                function_calls[tool_call.index] = {
+                    "id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "args": tool_call.function.arguments,
+                }
+                continue
+
+            if tool_call.function == None or tool_call.function.arguments == None:
+                continue
+            if function_calls[tool_call.index]["args"] == None:
+                function_calls[tool_call.index]["args"] = tool_call.function.arguments
+            else:
+                function_calls[tool_call.index]["args"] += tool_call.function.arguments
+
+    def _parse_tool_call(self, func_call: dict) -> tuple[str, dict, str]:
+        name = func_call["name"] if func_call["name"] else ""
+        args = json.loads(func_call["args"] if func_call["args"] else "{}")
+        call_id = func_call["id"] if func_call["id"] else ""
+        return name, args, call_id
+
+    def _append_tool_call_message(self, function_calls: dict):
+        self._append_message(
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
                     {
-                        "tool_call_id": call_id,
-                        "role": "tool",
-                        "name": name,
-                        "content": json.dumps(tool_response),
+                        "id": func_call["id"],
+                        "type": "function",
+                        "function": {
+                            "name": func_call["name"],
+                            "arguments": func_call["args"] or "{}",
+                        },
                     }
-                )
-            self._run_prompt(client, stream)
-        else:
-            return
+                    for func_call in function_calls.values()
+                ],
+            }
+        )
+
+    def _append_tool_response(self, call_id: str, name: str, tool_response: dict):
+        # Failed calls are reported to the model as {"error": ...}, successful ones keep the plain result
+        self._append_message(
+            {
+                "tool_call_id": call_id,
+                "role": "tool",
+                "name": name,
+                "content": json.dumps(
+                    tool_response["result"] if "result" in tool_response else tool_response
+                ),
+            }
+        )
+
+    def _append_message(self, message: dict):
+        self.messages.append(message)
+        self.added_messages.append(message)
 
     def _handle_tool_call(self, name: str, args: dict):
         if name in self.functions:
@@ -250,157 +509,23 @@ class PromptGenerator:
         return None
 
     def _generate_prompt(self):
+        if self.pinned_instructions:
+            return self.prompt
 
-        # User Profile
-        user_profile = self._get_user_profile()
+        return f"{self.prompt.strip()}\n\n{self.instructions()}"
 
-        # Answer Style
-        answer_style = self._get_answer_style()
+    def instructions(self) -> str:
+        return self._template().text
 
-        # Response Structure
-        response_structure = (
-            f"""Response Structure: {self.response_structure}"""
-            if self.response_structure
-            else ""
-        )
+    def instructions_tokens(self) -> int:
+        return self._template().tokens
 
-        # Answer Format
-        answer_format = self._get_format()
-
-        language = (
-            f"""
-            Language Style:
-            - The answer should always be appropriate for the user profile.
-            - Use words, that are suited for the user profile. Prefer simple words over technical jargon.
-            - Do not answer directly to the user. Instead, provide a general answer that is easy to understand.
-            - Do not mention the user profile itself in the answer. The answer should be general.
-            - Use professional language, that is appropriate for the user profile.
-        """
-            if self.plain == False
-            else ""
+    def _template(self) -> CompiledTemplate:
+        return prompt_templates.get(
+            self.model.value,
+            self.persona.value if self.persona else None,
+            self.answerStyle.value if self.answerStyle else None,
+            self.format.value if self.format else None,
+            self.plain,
+            self.response_structure,
         )
-
-        return f"""
-    
-            {self.prompt}
-            
-            {language}
-    
-            {response_structure}
-            
-            Answer Style:
-            {answer_style}
-            
-            Answer Format:
-            {answer_format}
-            - Return the html code directly, if you created if with an function or tool call.
-    
-            User Profile:
-            {user_profile}
-        """
-
-    def _get_user_profile(self):
-        if self.persona == None:
-            return f"""
-                - The user profile is not defined.
-            """
-        if self.persona == Persona.NON_TECHNICAL:
-            return f"""
-                - The user is a non-technical person.
-                - The user is not familiar with technical jargon.
-                - The user is not familiar with statistical concepts, terms, methods or abbreviations.
-                - The user is not familiar with machine learning or artificial intelligence.
-                - The user is not familiar with programming languages.
-                - The user is not familiar with data science.
-                - The user might be familiar with basic concepts of marketing, sales, or business.
-            """
-        elif self.persona == Persona.TECHNICAL:
-            return f"""
-                - The user is a technical person.
-                - The user is familiar with technical jargon.
-                - The user is familiar with statistical concepts, terms, methods or abbreviations.
-                - The user is familiar with machine learning or artificial intelligence.
-                - The user is familiar with programming languages.
-                - The user is familiar with data science.
-                - The user might be familiar with basic concepts of marketing, sales, or business.
-            """
-        elif self.persona == Persona.BUSINESS:
-            return f"""
-                - The user is a business person.
-                - The user is not familiar with technical jargon.
-                - The user is not familiar with statistical concepts, terms, methods or abbreviations.
-                - The user is not familiar with machine learning or artificial intelligence.
-                - The user is not familiar with programming languages.
-                - The user is not familiar with data science.
-                - The user is familiar with concepts of marketing, sales, or business.
-                - The user is familiar with financial concepts.
-                - The user understands technical, statistical and ai concepts better when explained in simple terms.
-                - The user preferes examples from real life scenarios, for technical, statistical and ai concepts.
-            """
-        elif self.persona == Persona.EXPERT:
-            return f"""
-                - The user is an expert in the field.
-                - The user is familiar with technical jargon.
-                - The user is familiar with statistical concepts, terms, methods or abbreviations.
-                - The user is familiar with machine learning or artificial intelligence.
-                - The user is familiar with programming languages.
-                - The user is familiar with data science.
-                - The user is familiar with concepts of marketing, sales, or business.
-            """
-        else:
-            return "Unknown user profile"
-
-    def _get_answer_style(self):
-        if self.answerStyle == None:
-            return f"""
-                - The Answer Style is not defined.
-            """
-        if self.answerStyle == AnswerStyle.EXPLANATION:
-            return f"""
-                - The answer should be an explanation.
-                - The explanation should contain an introduction, body and conclusion.
-                - The explanation should be visualized with examples, if possible and appropriate.
-            """
-        elif self.answerStyle == AnswerStyle.STRUCTURED:
-            return f"""
-                - The answer should be structured.
-                - The answer should fill in the blanks of the previously provided structure.
-            """
-        else:
-            return "Unknown answer style"
-
-    def _get_format(self):
-        if self.format == None:
-            return f"""
-                - The Format is not defined.
-            """
-        if self.format == Format.NO_FORMAT:
-            return f"""
-                - The answer should be in plain text.
-            """
-        elif self.format == Format.JSON:
-            return f"""
-                - The answer should be in JSON format.
-            """
-        elif self.format == Format.HTML:
-            return f"""
-                - Do not use markdown!
-                - Do not wrap the html in an markdown code block!
-                - The answer should be in HTML format.
-                - Wrap numbers in <code> tags.
-                - Wrap code in <code> tags.
-                - Wrap code blocks in <pre> tags.
-                - Use h3, h4, h5, h6 tags for headings.
-                - Use <ul> and <li> tags for lists.
-                - Use <a> tags for links.
-                - Use <strong> tags for bold text.
-                - Use <em> tags for italic text.
-                - Use <blockquote> tags for quotes.
-                - Do not use other HTML tags.
-            """
-        elif self.format == Format.MARKDOWN:
-            return f"""
-                - The answer should be in Markdown format.
-            """
-        else:
-            return "Unknown format"
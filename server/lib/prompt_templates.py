@@ -0,0 +1,175 @@
+import json
+import threading
+
+from lib.context_window import count_tokens
+
+# Instruction fragments keyed by the enum values of lib.prompt, None stands for an undefined option
+USER_PROFILES = {
+    None: """
+        - The user profile is not defined.
+    """,
+    "non_technical": """
+        - The user is a non-technical person.
+        - The user is not familiar with technical jargon.
+        - The user is not familiar with statistical concepts, terms, methods or abbreviations.
+        - The user is not familiar with machine learning or artificial intelligence.
+        - The user is not familiar with programming languages.
+        - The user is not familiar with data science.
+        - The user might be familiar with basic concepts of marketing, sales, or business.
+    """,
+    "technical": """
+        - The user is a technical person.
+        - The user is familiar with technical jargon.
+        - The user is familiar with statistical concepts, terms, methods or abbreviations.
+        - The user is familiar with machine learning or artificial intelligence.
+        - The user is familiar with programming languages.
+        - The user is familiar with data science.
+        - The user might be familiar with basic concepts of marketing, sales, or business.
+    """,
+    "business": """
+        - The user is a business person.
+        - The user is not familiar with technical jargon.
+        - The user is not familiar with statistical concepts, terms, methods or abbreviations.
+        - The user is not familiar with machine learning or artificial intelligence.
+        - The user is not familiar with programming languages.
+        - The user is not familiar with data science.
+        - The user is familiar with concepts of marketing, sales, or business.
+        - The user is familiar with financial concepts.
+        - The user understands technical, statistical and ai concepts better when explained in simple terms.
+        - The user preferes examples from real life scenarios, for technical, statistical and ai concepts.
+    """,
+    "expert": """
+        - The user is an expert in the field.
+        - The user is familiar with technical jargon.
+        - The user is familiar with statistical concepts, terms, methods or abbreviations.
+        - The user is familiar with machine learning or artificial intelligence.
+        - The user is familiar with programming languages.
+        - The user is familiar with data science.
+        - The user is familiar with concepts of marketing, sales, or business.
+    """,
+}
+
+ANSWER_STYLES = {
+    None: """
+        - The Answer Style is not defined.
+    """,
+    "explanation": """
+        - The answer should be an explanation.
+        - The explanation should contain an introduction, body and conclusion.
+        - The explanation should be visualized with examples, if possible and appropriate.
+    """,
+    "structured": """
+        - The answer should be structured.
+        - The answer should fill in the blanks of the previously provided structure.
+    """,
+}
+
+FORMATS = {
+    None: """
+        - The Format is not defined.
+    """,
+    "no_format": """
+        - The answer should be in plain text.
+    """,
+    "json": """
+        - The answer should be in JSON format.
+    """,
+    "html": """
+        - Do not use markdown!
+        - Do not wrap the html in an markdown code block!
+        - The answer should be in HTML format.
+        - Wrap numbers in <code> tags.
+        - Wrap code in <code> tags.
+        - Wrap code blocks in <pre> tags.
+        - Use h3, h4, h5, h6 tags for headings.
+        - Use <ul> and <li> tags for lists.
+        - Use <a> tags for links.
+        - Use <strong> tags for bold text.
+        - Use <em> tags for italic text.
+        - Use <blockquote> tags for quotes.
+        - Do not use other HTML tags.
+    """,
+    "markdown": """
+        - The answer should be in Markdown format.
+    """,
+}
+
+LANGUAGE_STYLE = """
+    Language Style:
+    - The answer should always be appropriate for the user profile.
+    - Use words, that are suited for the user profile. Prefer simple words over technical jargon.
+    - Do not answer directly to the user. Instead, provide a general answer that is easy to understand.
+    - Do not mention the user profile itself in the answer. The answer should be general.
+    - Use professional language, that is appropriate for the user profile.
+"""
+
+
+def normalize_whitespace(text: str) -> str:
+    # Indentation and blank line runs are billed as tokens, sections stay separated by one empty line
+    lines = []
+    for line in text.strip().splitlines():
+        line = " ".join(line.split())
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class CompiledTemplate:
+    def __init__(self, text: str, tokens: int) -> None:
+        self.text = text
+        self.tokens = tokens
+
+
+class TemplateRegistry:
+    # Every combination of options is compiled once, later lookups are a dictionary access
+    def __init__(self) -> None:
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def get(
+        self,
+        model: str,
+        persona: str | None,
+        answer_style: str | None,
+        format: str | None,
+        plain: bool,
+        response_structure: str | dict | None = None,
+    ) -> CompiledTemplate:
+        key = (
+            model,
+            persona,
+            answer_style,
+            format,
+            plain,
+            json.dumps(response_structure, sort_keys=True),
+        )
+
+        template = self.templates.get(key)
+        if template is None:
+            text = self._compile(persona, answer_style, format, plain, response_structure)
+            template = CompiledTemplate(text, count_tokens(text, model))
+            with self.lock:
+                self.templates.setdefault(key, template)
+
+        return template
+
+    def _compile(self, persona, answer_style, format, plain, response_structure) -> str:
+        sections = []
+
+        if not plain:
+            sections.append(LANGUAGE_STYLE.strip())
+
+        if response_structure:
+            sections.append(f"Response Structure: {response_structure}")
+
+        sections.append(f"Answer Style:\n{ANSWER_STYLES[answer_style].strip()}")
+        sections.append(
+            f"Answer Format:\n{FORMATS[format].strip()}\n"
+            "- Return the html code directly, if you created if with an function or tool call."
+        )
+        sections.append(f"User Profile:\n{USER_PROFILES[persona].strip()}")
+
+        return normalize_whitespace("\n\n".join(sections))
+
+
+prompt_templates = TemplateRegistry()
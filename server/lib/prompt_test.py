@@ -2,10 +2,16 @@ import json
 from openai import AsyncClient, AsyncStream
 from dotenv import load_dotenv
 import os
+import sys
 
-from prompt import PromptGenerator
+# lib.prompt imports other lib modules, so the server directory has to be on the path
+# (python lib/prompt_test.py from server/ or python prompt_test.py from lib/ both work)
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER_PATH)
 
-load_dotenv("../../.env")
+from lib.prompt import PromptGenerator
+
+load_dotenv(os.path.join(SERVER_PATH, "../.env"))
 api_key = os.environ.get("OPENAI_API_KEY")
 
 if not api_key:
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from lib.columnar import load_columns, normalize_data
+from lib.database import get_report_columns, get_report_results
+
+CACHE_SIZE = int(os.environ.get("RESULTS_CACHE_SIZE", "16"))
+
+
+class ReportResults:
+    def __init__(
+        self,
+        index: np.ndarray,
+        columns: dict[str, np.ndarray],
+        metrics: dict,
+        context: str,
+    ) -> None:
+        self.index = index
+        self.columns = columns
+        self.metrics = metrics
+        self.context = context
+
+
+def load_results(report_id: int) -> ReportResults:
+    results_json = get_report_results(report_id)
+    if results_json is None:
+        raise KeyError(f"Report {report_id} not found")
+
+    results = json.loads(results_json)
+
+    # Reports written before the columnar format still carry their data inline
+    if "data" in results:
+        index, columns = normalize_data(results["data"])
+    else:
+        index_digest, column_digests = get_report_columns(report_id)
+        index, columns = load_columns(index_digest, column_digests)  # type: ignore
+
+    return ReportResults(index, columns, results["metrics"], results["context"])
+
+
+class ResultsCache:
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.entries: OrderedDict[int, ReportResults] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, report_id: int) -> ReportResults:
+        with self.lock:
+            if report_id in self.entries:
+                self.entries.move_to_end(report_id)
+                return self.entries[report_id]
+
+        results = load_results(report_id)
+
+        with self.lock:
+            self.entries[report_id] = results
+            self.entries.move_to_end(report_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        return results
+
+    def invalidate(self, report_id: int):
+        with self.lock:
+            self.entries.pop(report_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+results_cache = ResultsCache(CACHE_SIZE)
+
+
+def get_results(report_id: int) -> ReportResults:
+    return results_cache.get(report_id)
+
+
+def invalidate_results(report_id: int):
+    results_cache.invalidate(report_id)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from lib.database import connection
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "1000"))
+SESSION_IDLE_TTL = int(os.environ.get("SESSION_IDLE_TTL", str(60 * 60)))
+
+
+class SessionStore(ABC):
+    @abstractmethod
+    def get(self, session_id: str) -> dict | None: ...
+
+    @abstractmethod
+    def set(self, session_id: str, session: dict): ...
+
+    @abstractmethod
+    def delete(self, session_id: str): ...
+
+    # Used from async handlers, blocking stores run in a worker thread instead of on the event loop
+    async def aget(self, session_id: str) -> dict | None:
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def aset(self, session_id: str, session: dict):
+        await asyncio.to_thread(self.set, session_id, session)
+
+
+class InMemorySessionStore(SessionStore):
+    # LRU bounded by SESSION_MAX, sessions idle for longer than the ttl are dropped
+    def __init__(self, max_sessions: int, idle_ttl: int) -> None:
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.sessions: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self.sessions:
+            session_id, (last_access, _) = next(iter(self.sessions.items()))
+            if len(self.sessions) > self.max_sessions or now - last_access > self.idle_ttl:
+                del self.sessions[session_id]
+            else:
+                break
+
+    def get(self, session_id: str) -> dict | None:
+        now = time.time()
+        with self.lock:
+            self._evict(now)
+            if session_id not in self.sessions:
+                return None
+            _, session = self.sessions[session_id]
+            self.sessions[session_id] = (now, session)
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def set(self, session_id: str, session: dict):
+        now = time.time()
+        with self.lock:
+            self.sessions[session_id] = (now, session)
+            self.sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    # Only a short lock is taken, no thread hop needed
+    async def aget(self, session_id: str) -> dict | None:
+        return self.get(session_id)
+
+    async def aset(self, session_id: str, session: dict):
+        self.set(session_id, session)
+
+
+class SqliteSessionStore(SessionStore):
+    # Shared between uvicorn worker processes through the database
+    def __init__(self, idle_ttl: int) -> None:
+        self.idle_ttl = idle_ttl
+
+    def get(self, session_id: str) -> dict | None:
+        with connection() as db:
+            row = db.execute(
+                "SELECT data FROM chat_sessions WHERE id = ? AND updated_at > ?",
+                (session_id, time.time() - self.idle_ttl),
+            ).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def set(self, session_id: str, session: dict):
+        now = time.time()
+        with connection() as db:
+            db.execute(
+                "INSERT INTO chat_sessions (id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (session_id, json.dumps(session), now),
+            )
+            db.execute(
+                "DELETE FROM chat_sessions WHERE updated_at <= ?",
+                (now - self.idle_ttl,),
+            )
+
+    def delete(self, session_id: str):
+        with connection() as db:
+            db.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+
+
+def create_session_store() -> SessionStore:
+    if SESSION_STORE == "sqlite":
+        return SqliteSessionStore(SESSION_IDLE_TTL)
+    return InMemorySessionStore(SESSION_MAX, SESSION_IDLE_TTL)
+
+
+session_store = create_session_store()
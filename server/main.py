@@ -1,20 +1,45 @@
-import datetime
+from contextlib import asynccontextmanager
 import json
+import uuid
 
 from dotenv import load_dotenv
 import os
 from typing import Annotated, Optional, Union
-from fastapi import FastAPI, Response, WebSocket, File, UploadFile, Form
-import sqlite3
+from fastapi import (
+    FastAPI,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    File,
+    UploadFile,
+    Form,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-import openai
 
+from lib.database import (
+    close_database,
+    get_report_pdf_by_label,
+    list_reports,
+    list_reports_page,
+    open_database,
+)
 from lib.database_seed import seed
-from lib.pdf_generator.generate import generate_pdf
-import time
-
-from lib.chat import handleMessage, init_chat, update_user_profile
+from lib.ingest import InvalidResultsError, ingest_results
+from lib.jobs import job_manager
+from lib.openai_client import close_clients
+from lib.file_store import touch
+from lib.plot_store import plot_store
+
+from lib.chat import (
+    cancel_quick_actions,
+    handleMessage,
+    init_chat,
+    render_plot_recipe,
+    update_user_profile,
+)
 
 load_dotenv("../.env")
 
@@ -22,10 +47,20 @@ api_key = os.environ.get("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("API key not found")
 
-client = openai.Client(
-    api_key=api_key,
-)
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_database()
+    seed()
+    job_manager.start()
+    yield
+    job_manager.shutdown()
+    await close_clients()
+    close_database()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -38,25 +73,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-seed()
-
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
 @app.get("/reports")
-def get_reports():
-    db = sqlite3.connect("db.sqlite3")
-
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM reports")
-    reports = cursor.fetchall()
-
-    cursor.close()
+def get_reports(
+    response: Response, limit: Optional[int] = None, cursor: Optional[str] = None
+):
+    if limit is None:
+        reports = list_reports()
+    else:
+        try:
+            reports, next_cursor = list_reports_page(min(max(limit, 1), 100), cursor)
+        except ValueError:
+            response.status_code = 400
+            return {"error": "Invalid cursor"}
+
+        # The body stays a plain list, the cursor for the next page is sent as header
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
 
     clean_reports = [
-        {"id": report[0], "label": report[1], "created_at": report[4]}
+        {"id": report[0], "label": report[1], "created_at": report[2]}
         for report in reports
     ]
 
@@ -64,24 +105,19 @@ def get_reports():
 
 
 @app.get("/report/{label}")
-def get_single_report_pdf(label: str):
-    db = sqlite3.connect("db.sqlite3")
-
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM reports WHERE label = ?", (label,))
-    report = cursor.fetchone()
-
-    cursor.close()
+def get_single_report_pdf(label: str, response: Response):
+    report = get_report_pdf_by_label(label)
 
     if report is None:
-        return {"error": "Report not found"}, 404
+        response.status_code = 404
+        return {"error": "Report not found"}
 
-    filename = report[1].replace(" ", "_")
+    filename = report[0].replace(" ", "_")
     quoted_filename = f'filename="{filename}.pdf"'
 
     # Return the pdf file with respective content type
     return Response(
-        content=report[2],
+        content=report[1],
         media_type="application/pdf",
         headers={"Content-Disposition": f"inline; {quoted_filename}"},
     )
@@ -89,55 +125,99 @@ def get_single_report_pdf(label: str):
 
 @app.post("/upload")
 async def upload_report(
-    label: Annotated[str, Form()], file: Annotated[UploadFile, Form()]
+    response: Response,
+    label: Annotated[str, Form()],
+    file: Annotated[UploadFile, Form()],
 ):
 
     try:
-        file_data = await file.read()
-        results = json.loads(file_data.decode("utf-8"))
-        filename = str(int(time.time()))
+        # Parse the upload incrementally, columns are written to the column store while reading
+        ingested = await run_in_threadpool(ingest_results, file.file)
+    except InvalidResultsError as error:
+        response.status_code = 400
+        return {"error": f"Invalid results file: {error}"}
 
-        generate_pdf(filename, results)
-    except json.JSONDecodeError:
-        return {"error": "Invalid JSON"}, 500
+    # The PDF is generated in a worker process, the client follows the job via /jobs/{id} or the websocket
+    job = job_manager.submit(label, ingested)
 
-    with open(f"{filename}.pdf", "rb") as pdf_file:
-        pdf = pdf_file.read()
+    return {"job_id": job.id, "status": job.status}
 
-    # Remove pdf
-    os.remove(f"{filename}.pdf")
 
-    db = sqlite3.connect("db.sqlite3")
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, response: Response):
+    job = job_manager.get(job_id)
+
+    if job is None:
+        response.status_code = 404
+        return {"error": "Job not found"}
+
+    return job.to_dict()
 
-    cursor = db.cursor()
-    cursor.execute(
-        "INSERT INTO reports (label, pdf_file, results_json, created_at) VALUES (?, ?, ?, ?)",
-        (label, pdf, json.dumps(results), datetime.datetime.now().isoformat()),
-    )
 
-    db.commit()
-    cursor.close()
+@app.get("/plots/{name}")
+async def get_plot(name: str, response: Response):
+    key, _, extension = name.partition(".")
+    if not plot_store.is_key(key) or extension != "png":
+        response.status_code = 404
+        return {"error": "Plot not found"}
 
-    return {"filename": file}
+    file = plot_store.file(plot_store.name(key, extension))
+
+    # Serving a plot counts as an access for the eviction order
+    if not touch(file):
+        # Evicted plots that are still referenced (e.g. by cached answers) are rendered again
+        recipe = plot_store.recipe(key)
+        if recipe is None:
+            response.status_code = 404
+            return {"error": "Plot not found"}
+
+        name = await run_in_threadpool(render_plot_recipe, recipe)
+        file = plot_store.file(name)
+
+    return FileResponse(file, media_type="image/png")
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    while True:
-        data = await websocket.receive_text()
-        json_data = json.loads(data)
 
-        if "type" not in json_data:
-            continue
+    # Each connection has its own session, a reconnecting client can resume it with ?session=<id>
+    session_id = websocket.query_params.get("session") or uuid.uuid4().hex
+    await websocket.send_json({"type": "session", "sessionId": session_id})
 
-        if json_data["type"] == "initChat":
-            await init_chat(websocket, json_data["chatId"], json_data["user_profile"])
-
-        if json_data["type"] == "update_user_profile":
-            await update_user_profile(websocket, json_data["user_profile"])
-
-        if json_data["type"] == "message":
-            await handleMessage(
-                api_key, websocket, json_data["message"], json_data["user_profile"]
-            )
+    try:
+        while True:
+            data = await websocket.receive_text()
+            json_data = json.loads(data)
+
+            if "type" not in json_data:
+                continue
+
+            if json_data["type"] == "initChat":
+                await init_chat(
+                    websocket,
+                    session_id,
+                    json_data["chatId"],
+                    json_data["user_profile"],
+                    json_data.get("protocol", "full"),
+                    json_data.get("plotMode", "image"),
+                )
+
+            if json_data["type"] == "update_user_profile":
+                await update_user_profile(
+                    websocket, session_id, json_data["user_profile"]
+                )
+
+            if json_data["type"] == "subscribe_job":
+                job_manager.subscribe(websocket, json_data["jobId"])
+
+            if json_data["type"] == "message":
+                await handleMessage(
+                    api_key,
+                    websocket,
+                    session_id,
+                    json_data["message"],
+                    json_data["user_profile"],
+                )
+    except WebSocketDisconnect:
+        cancel_quick_actions(session_id)